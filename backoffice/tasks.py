@@ -1,10 +1,12 @@
 import openpyxl
 from celery import shared_task
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage # Para leer desde S3/R2
 from django.contrib.auth import get_user_model
 from tenancy.models import Tenant
 from exams.models import Exam, Item, ExamItemLink
+from plataforma import gemini
 
 User = get_user_model()
 
@@ -126,3 +128,64 @@ def process_exam_excel(self, tenant_id, user_id, exam_title, temp_file_path):
         if 'temp_file_path' in locals() and default_storage.exists(temp_file_path):
             default_storage.delete(temp_file_path)
         raise e
+
+
+# --- GENERACIÓN DE PREGUNTAS CON IA (curaduría) ---
+# La vista encola y el modal consulta el estado por polling: cada pregunta
+# aparece apenas Gemini termina de escribirla, sin bloquear un worker de gunicorn.
+AI_JOB_TTL = 60 * 60
+MAX_AI_ITEMS = 10
+
+
+def ai_job_key(job_id):
+    return f"ai_items:{job_id}"
+
+
+def build_ai_items_prompt(tenant_id, user_prompt):
+    existing_stems = Item.objects.filter(
+        tenant_id=tenant_id,
+        stem__icontains=user_prompt
+    ).values_list('stem', flat=True)[:20]
+
+    avoid_text = ""
+    if existing_stems:
+        lista_preguntas = "\n- ".join(existing_stems)
+        avoid_text = f"\nIMPORTANTE - YA TENGO ESTAS PREGUNTAS, NO LAS REPITAS:\n{lista_preguntas}\n"
+
+    return (
+        "Eres un experto en evaluación académica universitaria.\n"
+        f"PEDIDO: \"{user_prompt}\".\n"
+        "INSTRUCCIONES:\n"
+        "1. Genera preguntas de opción múltiple según el pedido (Máx 10).\n"
+        "2. Si no pide cantidad, genera 5.\n"
+        "3. INCLUYE ETIQUETAS: Para cada pregunta, genera un string con 2 o 3 etiquetas clave separadas por comas (ej: 'Historia, Europa, Guerra') en el campo 'tags'.\n"
+        f"{avoid_text}"
+        "\n"
+        "--- FORMATO JSON ---\n"
+        "Devuelve SOLO un JSON Array válido:\n"
+        "[{\"stem\": \"...\", \"correct_answer\": \"...\", \"distractors\": [\"...\", \"...\"], \"tags\": \"tag1, tag2\"}]"
+    )
+
+
+@shared_task
+def generate_ai_items(job_id, exam_id, user_prompt):
+    """Genera las preguntas en streaming y las va dejando en el cache del job."""
+    exam = Exam.objects.filter(id=exam_id).only('tenant_id').first()
+    if not exam:
+        return None
+    state = {'exam_id': exam_id, 'status': 'running', 'items': [], 'error': ''}
+    try:
+        prompt = build_ai_items_prompt(exam.tenant_id, user_prompt)
+        for item in gemini.stream_json_array(prompt, tenant_id=exam.tenant_id, purpose='items'):
+            if not isinstance(item, dict) or not item.get('stem') or not item.get('correct_answer'):
+                continue
+            state['items'].append(item)
+            cache.set(ai_job_key(job_id), state, AI_JOB_TTL)
+            if len(state['items']) >= MAX_AI_ITEMS:
+                break
+        state['status'] = 'done'
+    except Exception as e:
+        # Sin esto el modal quedaría esperando hasta que venza el job
+        state['status'], state['error'] = 'error', str(e)
+    cache.set(ai_job_key(job_id), state, AI_JOB_TTL)
+    return state['status']
@@ -38,9 +38,14 @@ urlpatterns = [
     path('exam/<int:exam_id>/publish/', views.exam_publish, name='exam_publish'),
     path('exam/<int:exam_id>/unpublish/', views.exam_unpublish, name='exam_unpublish'),
 
+    # --- Recorrección masiva ---
+    path('exam/<int:exam_id>/regrade/', views.exam_regrade, name='exam_regrade'),
+    path('exam/<int:exam_id>/regrade/<str:task_id>/status/', views.exam_regrade_status, name='exam_regrade_status'),
+
     # --- IA (Flujo de Curaduría) ---
     path('ai/distractors/', views.ai_generate_distractors, name='ai_generate_distractors'),
     path('exam/<int:exam_id>/ai/preview/', views.ai_preview_items, name='ai_preview_items'),
+    path('exam/<int:exam_id>/ai/preview/<str:job_id>/', views.ai_preview_status, name='ai_preview_status'),
     path('exam/<int:exam_id>/ai/commit/', views.ai_commit_items, name='ai_commit_items'),
 
     # --- Placeholders ---
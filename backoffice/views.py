@@ -15,15 +15,19 @@ from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.core.files.storage import default_storage
 from django.http import Http404
-from django.db import IntegrityError 
-from django.db.models import Count, Q, Sum 
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q, Sum 
+from django.db.models.functions import Lower
 from django.contrib import messages 
 from django.utils import timezone 
 from django.contrib.postgres.aggregates import StringAgg 
 
-import google.generativeai as genai 
-
-from exams.models import Exam, Item, ExamItemLink
+from exams.models import Exam, Item, ExamItemLink, exam_content_changed
+from exams.compiled import compile_exam
+from plataforma import gemini
+from runner.tasks import regrade_exam
+from .tasks import AI_JOB_TTL, ai_job_key, generate_ai_items
 from tenancy.models import TenantMembership
 
 # (S1c) Vista del Dashboard
@@ -196,20 +200,16 @@ def ai_generate_distractors(request):
     if not stem or not correct_answer:
         return HttpResponse("<p class='text-red-500'>Por favor, escribe el enunciado y la respuesta correcta primero.</p>")
 
+    membership = TenantMembership.objects.filter(user=request.user).first()
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash-preview-09-2025')
         prompt = (
             "Eres un asistente de educación experto en crear exámenes.\n"
             f"Genera 3 distractores incorrectos para: P: \"{stem}\" R: \"{correct_answer}\".\n"
             "Devuelve solo un array JSON de strings: [\"D1\", \"D2\", \"D3\"]"
         )
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-            )
+        distractors, _ = gemini.generate_json(
+            prompt, tenant_id=membership.tenant_id if membership else None, purpose='distractors'
         )
-        distractors = json.loads(response.text)
         if len(distractors) < 3:
             distractors.extend(["", ""]) 
         
@@ -302,6 +302,7 @@ def add_item_to_exam(request, exam_id, item_id):
 def remove_item_from_exam(request, exam_id, item_id):
     exam = get_object_or_404(Exam, id=exam_id, tenant__memberships__user=request.user)
     ExamItemLink.objects.filter(exam=exam, item_id=item_id).delete()
+    exam_content_changed(exam.id)
     context = _get_constructor_context(request, exam_id)
     return render(request, 'backoffice/partials/_constructor_oob_update.html', context)
 
@@ -313,6 +314,7 @@ def exam_update_title(request, exam_id):
     if new_title:
         exam.title = new_title
         exam.save()
+        exam_content_changed(exam.id)
     return HttpResponse(status=204)
 
 @login_required
@@ -469,51 +471,48 @@ def ai_preview_items(request, exam_id):
     if not user_prompt:
         return HttpResponse(status=204)
 
+    # La generación corre en Celery; el modal se abre ya y va sumando preguntas
+    job_id = uuid.uuid4().hex
     try:
-        existing_stems = Item.objects.filter(
-            tenant=exam.tenant,
-            stem__icontains=user_prompt
-        ).values_list('stem', flat=True)[:20]
+        cache.set(ai_job_key(job_id), {'exam_id': exam.id, 'status': 'running', 'items': [], 'error': ''}, AI_JOB_TTL)
+        generate_ai_items.delay(job_id, exam.id, user_prompt)
+    except Exception as e:
+        # Broker o cache caídos: se avisa en vez de abrir un modal que nunca se llena
+        return HttpResponse(f"<div class='bg-red-100 text-red-700 p-4 rounded mb-4'>Error IA: {e}</div>")
 
-        avoid_text = ""
-        if existing_stems:
-            lista_preguntas = "\n- ".join(existing_stems)
-            avoid_text = f"\nIMPORTANTE - YA TENGO ESTAS PREGUNTAS, NO LAS REPITAS:\n{lista_preguntas}\n"
+    context = _ai_job_context(exam, job_id, after=0)
+    context['user_prompt'] = user_prompt
+    return render(request, 'backoffice/partials/_ai_curation_modal.html', context)
 
-        model = genai.GenerativeModel('gemini-2.5-flash-preview-09-2025')
-        
-        prompt = (
-            "Eres un experto en evaluación académica universitaria.\n"
-            f"PEDIDO: \"{user_prompt}\".\n"
-            "INSTRUCCIONES:\n"
-            "1. Genera preguntas de opción múltiple según el pedido (Máx 10).\n"
-            "2. Si no pide cantidad, genera 5.\n"
-            "3. INCLUYE ETIQUETAS: Para cada pregunta, genera un string con 2 o 3 etiquetas clave separadas por comas (ej: 'Historia, Europa, Guerra') en el campo 'tags'.\n"
-            f"{avoid_text}"
-            "\n"
-            "--- FORMATO JSON ---\n"
-            "Devuelve SOLO un JSON Array válido:\n"
-            "[{\"stem\": \"...\", \"correct_answer\": \"...\", \"distractors\": [\"...\", \"...\"], \"tags\": \"tag1, tag2\"}]"
-        )
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(response_mime_type="application/json")
-        )
-        
-        generated_data = json.loads(response.text)
-        
-        for item in generated_data:
-            item['json_string'] = json.dumps(item)
-        
-        return render(request, 'backoffice/partials/_ai_curation_modal.html', {
-            'exam': exam,
-            'generated_items': generated_data,
-            'user_prompt': user_prompt
-        })
 
-    except Exception as e:
-        return HttpResponse(f"<div class='bg-red-100 text-red-700 p-4 rounded mb-4'>Error IA: {e}</div>")
+@login_required
+def ai_preview_status(request, exam_id, job_id):
+    exam = get_object_or_404(Exam, id=exam_id, tenant__memberships__user=request.user)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    return render(request, 'backoffice/partials/_ai_curation_stream.html', _ai_job_context(exam, job_id, after))
+
+
+def _ai_job_context(exam, job_id, after):
+    """Preguntas nuevas del job (desde la posición `after`) y su estado."""
+    state = cache.get(ai_job_key(job_id))
+    if not state or state['exam_id'] != exam.id:
+        state = {'status': 'error', 'items': [], 'error': 'La generación expiró. Vuelve a intentarlo.'}
+
+    generated_items = state['items'][after:]
+    for item in generated_items:
+        item['json_string'] = json.dumps(item)
+
+    return {
+        'exam': exam,
+        'job_id': job_id,
+        'generated_items': generated_items,
+        'after': after + len(generated_items),
+        'status': state['status'],
+        'error': state['error'],
+    }
 
 
 @login_required
@@ -524,9 +523,9 @@ def ai_commit_items(request, exam_id):
     items_all_json = request.POST.getlist('items_all')
     items_selected_json = set(request.POST.getlist('items_selected'))
     
-    saved_count = 0
-    added_to_exam_count = 0
-    
+    # 1. Parseo (una pregunta inválida no frena al resto)
+    parsed = {}
+    selected_stems = set()
     for item_json in items_all_json:
         try:
             clean_json = item_json.replace('\n', ' ').replace('\r', '')
@@ -535,31 +534,61 @@ def ai_commit_items(request, exam_id):
             options_list = [{"text": data['correct_answer'], "correct": True}]
             for dist in data.get('distractors', []):
                 options_list.append({"text": dist, "correct": False})
-            
-            default_tag = data.get('tags', 'IA-Gen')
-            
-            item, created = Item.objects.get_or_create(
-                tenant=exam.tenant,
-                stem__iexact=data['stem'].strip(),
-                defaults={
-                    'author': request.user,
-                    'item_type': 'MC',
-                    'stem': data['stem'].strip(),
-                    'difficulty': 2,
-                    'options': options_list,
-                    'tags': default_tag
-                }
-            )
-            saved_count += 1
-            
-            if item_json in items_selected_json:
-                ExamItemLink.objects.get_or_create(exam=exam, item=item)
-                added_to_exam_count += 1
-            
+
+            stem = data['stem'].strip()
         except Exception as e:
-            print(f"Error guardando item IA: {e}")
+            print(f"Error leyendo item IA: {e}")
             continue
 
+        key = stem.lower()
+        parsed.setdefault(key, Item(
+            tenant=exam.tenant,
+            author=request.user,
+            item_type='MC',
+            stem=stem,
+            difficulty=2,
+            options=options_list,
+            tags=data.get('tags', 'IA-Gen'),
+        ))
+        if item_json in items_selected_json:
+            selected_stems.add(key)
+
+    # 2. Una transacción: ítems nuevos y vínculos al examen en dos bulk_create
+    try:
+        with transaction.atomic():
+            existing = {
+                item.stem_lower: item
+                for item in Item.objects.filter(tenant=exam.tenant)
+                                        .annotate(stem_lower=Lower('stem'))
+                                        .filter(stem_lower__in=list(parsed))
+            }
+            new_items = [item for key, item in parsed.items() if key not in existing]
+            Item.objects.bulk_create(new_items)
+            items_by_stem = {**{item.stem.lower(): item for item in new_items}, **existing}
+
+            linked_ids = set(ExamItemLink.objects.filter(exam=exam).values_list('item_id', flat=True))
+            last_order = ExamItemLink.objects.filter(exam=exam).aggregate(Max('order'))['order__max'] or 0
+            links = []
+            for key in parsed:
+                # LOWER() de Postgres y str.lower() no siempre coinciden (ej. 'İ'): se saltea
+                item = items_by_stem.get(key)
+                if item is None:
+                    continue
+                if key in selected_stems and item.id not in linked_ids:
+                    last_order += 1
+                    links.append(ExamItemLink(exam=exam, item=item, order=last_order))
+                    linked_ids.add(item.id)
+            ExamItemLink.objects.bulk_create(links)
+            # bulk_create no pasa por ExamItemLink.save(): invalidamos a mano
+            if links:
+                exam_content_changed(exam.id)
+    except IntegrityError as e:
+        messages.error(request, f"No se pudieron guardar las preguntas: {e}")
+        parsed, selected_stems = {}, set()
+
+    saved_count = len(parsed)
+    added_to_exam_count = len(selected_stems)
+
     if saved_count > 0:
         msg = f"Proceso finalizado: {saved_count} guardadas en Banco."
         if added_to_exam_count > 0:
@@ -589,6 +618,8 @@ def exam_publish(request, exam_id):
                 exam.status = "published" 
                 exam.published_at = timezone.now()
                 exam.save()
+                # Foto inmutable del examen para los runners
+                compile_exam(exam, force=True)
                 
                 if total_points != 10.0:
                     messages.warning(request, f"Examen publicado. Total: {total_points} (Ideal: 10).")
@@ -616,6 +647,7 @@ def exam_unpublish(request, exam_id):
         if exam.status == 'published':
             exam.status = "draft"
             exam.published_at = None
+            exam.compiled_version = None
             exam.save()
             messages.warning(request, "Examen revertido a Borrador.")
         else:
@@ -630,6 +662,34 @@ def exam_unpublish(request, exam_id):
     return render(request, 'backoffice/partials/_constructor_header.html', context)
 
 
+# --- RECORRECCIÓN MASIVA ---
+@login_required
+@require_http_methods(["POST"])
+def exam_regrade(request, exam_id):
+    """Encola la recorrección de todos los intentos del examen (runner.tasks.regrade_exam)."""
+    exam = get_object_or_404(Exam, id=exam_id, tenant__memberships__user=request.user)
+    task = regrade_exam.delay(exam.id)
+    return _render_regrade_status(request, exam, task)
+
+@login_required
+def exam_regrade_status(request, exam_id, task_id):
+    exam = get_object_or_404(Exam, id=exam_id, tenant__memberships__user=request.user)
+    return _render_regrade_status(request, exam, AsyncResult(task_id))
+
+def _render_regrade_status(request, exam, result):
+    info = result.info if isinstance(result.info, dict) else {}
+    context = {
+        'exam': exam,
+        'task_id': result.id,
+        'state': result.state,
+        'done': info.get('done', 0),
+        'total': info.get('total', 0),
+        'updated': info.get('updated', 0),
+        'error': str(result.info) if result.state == 'FAILURE' else None,
+    }
+    return render(request, 'backoffice/partials/_regrade_status.html', context)
+
+
 @login_required
 @require_http_methods(["POST"])
 def item_rotate_difficulty(request, item_id):
@@ -0,0 +1,93 @@
+"""
+Clave de respuestas compilada por examen, para corregir sin consultas.
+
+La clave es {item_id: (puntos, sha1 del texto correcto)} más el puntaje total.
+Se cachea en el proceso y en el cache compartido (Redis), bajo una versión
+por examen que se renueva cada vez que cambian los puntos o las opciones.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+
+# exam_id -> (version, clave) dentro de este proceso
+_local_keys = {}
+
+KEY_TTL = 60 * 60 * 24
+
+
+def _version_key(exam_id):
+    return f"answer_key:version:{exam_id}"
+
+
+def _payload_key(exam_id, version):
+    return f"answer_key:{exam_id}:{version}"
+
+
+def answer_hash(text):
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+
+
+def build_answer_key(exam_id):
+    from .models import ExamItemLink
+
+    items = {}
+    total_points = 0.0
+    links = ExamItemLink.objects.filter(exam_id=exam_id).values_list('item_id', 'points', 'item__options')
+    for item_id, points, options in links:
+        total_points += points
+        correct = next((o for o in (options or []) if o.get('correct')), None)
+        correct_hash = answer_hash(correct['text']) if correct and correct.get('text') is not None else None
+        items[str(item_id)] = (points, correct_hash)
+    return {'items': items, 'total_points': total_points}
+
+
+def grade(answer_key, answers, penalized_items=None, penalty_points=0.0):
+    """Nota sobre 10: ítems penalizados no suman, y se restan los puntos de penalidad."""
+    answers = answers or {}
+    penalized = {str(x) for x in (penalized_items or [])}
+    score_obtained = 0
+    total_possible_points = answer_key['total_points']
+
+    for item_id, (points_for_question, correct_hash) in answer_key['items'].items():
+        if item_id in penalized:
+            continue
+
+        selected = answers.get(item_id)
+        if selected and correct_hash and answer_hash(selected) == correct_hash:
+            score_obtained += points_for_question
+
+    final_score = 0.0
+    if total_possible_points > 0:
+        final_score = (score_obtained / total_possible_points) * 10
+
+    final_score -= (penalty_points or 0.0)
+    return max(0.0, final_score)
+
+
+def get_answer_key(exam_id):
+    version = cache.get(_version_key(exam_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        # add(): si otro proceso ya fijó una versión, respetamos la suya
+        if not cache.add(_version_key(exam_id), version, None):
+            version = cache.get(_version_key(exam_id), version)
+
+    local = _local_keys.get(exam_id)
+    if local and local[0] == version:
+        return local[1]
+
+    key = cache.get(_payload_key(exam_id, version))
+    if key is None:
+        key = build_answer_key(exam_id)
+        cache.set(_payload_key(exam_id, version), key, KEY_TTL)
+
+    _local_keys[exam_id] = (version, key)
+    return key
+
+
+def invalidate_answer_key(*exam_ids):
+    """Renueva la versión: los procesos detectan el cambio en la próxima corrección."""
+    for exam_id in exam_ids:
+        cache.set(_version_key(exam_id), uuid.uuid4().hex, None)
+        _local_keys.pop(exam_id, None)
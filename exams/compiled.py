@@ -0,0 +1,119 @@
+"""
+Payload compilado e inmutable de un examen (ExamVersion).
+
+Se compila al publicar (y de nuevo, en forma perezosa, si el examen se edita
+estando publicado). Como una versión no cambia nunca, su payload se cachea
+sin invalidación: en el proceso y en el cache compartido.
+"""
+import random
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+PAYLOAD_TTL = 60 * 60 * 24 * 7
+
+
+def _payload_key(version_id):
+    return f"exam_payload:{version_id}"
+
+
+def build_payload(exam):
+    from .models import ExamItemLink
+
+    links = ExamItemLink.objects.filter(exam=exam).select_related('item').order_by('order')
+    items = [{
+        'id': link.item_id,
+        'stem': link.item.stem,
+        'options': link.item.options or [],
+        'points': link.points,
+    } for link in links]
+
+    return {
+        'exam_id': exam.id,
+        'title': exam.title,
+        'items': items,
+        'total_points': sum(item['points'] for item in items),
+        'time_per_item': exam.time_per_item,
+        'total_duration': (len(items) * exam.time_per_item) + (exam.extra_time_buffer * 60),
+        'shuffle_items': exam.shuffle_items,
+        'shuffle_options': exam.shuffle_options,
+    }
+
+
+def compile_exam(exam, force=False):
+    """
+    Crea una versión nueva, la deja como vigente y devuelve su id.
+    Bloquea la fila del examen: si cientos de alumnos entran a la vez a un
+    examen recién editado, solo uno compila y el resto reutiliza su versión.
+    """
+    from .models import Exam, ExamVersion
+
+    with transaction.atomic():
+        locked = Exam.objects.select_for_update().get(id=exam.id)
+        if locked.compiled_version_id and not force:
+            exam.compiled_version_id = locked.compiled_version_id
+            return locked.compiled_version_id
+
+        last_number = ExamVersion.objects.filter(exam=locked).aggregate(n=Max('number'))['n'] or 0
+        payload = build_payload(locked)
+        version = ExamVersion.objects.create(exam=locked, number=last_number + 1, payload=payload)
+        Exam.objects.filter(id=locked.id).update(compiled_version=version)
+
+    exam.compiled_version_id = version.id
+    cache.set(_payload_key(version.id), payload, PAYLOAD_TTL)
+    return version.id
+
+
+@lru_cache(maxsize=256)
+def get_version_payload(version_id):
+    """Compartido entre requests: tratar el dict devuelto como solo lectura."""
+    payload = cache.get(_payload_key(version_id))
+    if payload is None:
+        from .models import ExamVersion
+        payload = ExamVersion.objects.values_list('payload', flat=True).get(id=version_id)
+        cache.set(_payload_key(version_id), payload, PAYLOAD_TTL)
+    return payload
+
+
+def get_compiled_exam(exam):
+    """Payload vigente del examen; compila si todavía no hay versión (o quedó vieja)."""
+    if not exam.compiled_version_id:
+        compile_exam(exam)
+    return get_version_payload(exam.compiled_version_id)
+
+
+# --- PERMUTACIÓN POR INTENTO ---
+# Se calcula una vez al crear el intento y se guarda como índices contra el
+# payload de la versión: item_order[i] = índice del ítem, option_order[j] =
+# orden de opciones del ítem j (lista vacía = sin mezclar).
+
+def build_permutation(payload, seed):
+    # Misma semilla que usaba el runner (str(attempt.id)): los intentos en curso conservan su orden
+    rng = random.Random(seed)
+    items = payload['items']
+    item_order = list(range(len(items)))
+    if payload['shuffle_items']:
+        rng.shuffle(item_order)
+
+    option_order = []
+    if payload['shuffle_options']:
+        for item in items:
+            order = list(range(len(item['options'])))
+            rng.shuffle(order)
+            option_order.append(order)
+    return item_order, option_order
+
+
+def ordered_items(payload, item_order, option_order):
+    """Ítems en el orden del intento, con sus opciones permutadas (sin tocar el payload cacheado)."""
+    items = payload['items']
+    result = []
+    for index in (item_order or range(len(items))):
+        item = items[index]
+        order = option_order[index] if index < len(option_order) else None
+        if order:
+            item = {**item, 'options': [item['options'][i] for i in order]}
+        result.append(item)
+    return result
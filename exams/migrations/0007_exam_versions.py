@@ -0,0 +1,32 @@
+# exams/migrations/0007_exam_versions.py
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0006_remove_item_case_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='exams.exam')),
+            ],
+            options={
+                'ordering': ['-number'],
+                'unique_together': {('exam', 'number')},
+            },
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='compiled_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='exams.examversion'),
+        ),
+    ]
@@ -2,6 +2,16 @@ import uuid
 from django.db import models
 from django.conf import settings
 from tenancy.models import Tenant
+from .answer_key import invalidate_answer_key
+
+
+def exam_content_changed(*exam_ids):
+    """Puntajes, opciones o ítems cambiaron: clave de corrección y payload compilado quedan viejos."""
+    if not exam_ids:
+        return
+    invalidate_answer_key(*exam_ids)
+    # El próximo render compila una versión nueva (ver exams.compiled)
+    Exam.objects.filter(id__in=exam_ids, compiled_version__isnull=False).update(compiled_version=None)
 
 class Item(models.Model):
     """
@@ -42,6 +52,19 @@ class Item(models.Model):
     def __str__(self):
         return self.stem[:60]
 
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        super().save(*args, **kwargs)
+        # Las opciones pueden haber cambiado: invalidar la clave de sus exámenes
+        if not is_new:
+            exam_content_changed(*self.exams.values_list('id', flat=True))
+
+    def delete(self, *args, **kwargs):
+        exam_ids = list(self.exams.values_list('id', flat=True))
+        result = super().delete(*args, **kwargs)
+        exam_content_changed(*exam_ids)
+        return result
+
 
 class Exam(models.Model):
     """
@@ -110,6 +133,16 @@ class Exam(models.Model):
         related_name='exams'
     )
     
+    # Versión compilada vigente (se genera al publicar; None = hay que recompilar)
+    compiled_version = models.ForeignKey(
+        'ExamVersion',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        editable=False
+    )
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -147,3 +180,28 @@ class ExamItemLink(models.Model):
             last_item = ExamItemLink.objects.filter(exam=self.exam).order_by('-order').first()
             self.order = (last_item.order + 1) if last_item else 1
         super().save(*args, **kwargs)
+        exam_content_changed(self.exam_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        exam_content_changed(self.exam_id)
+        return result
+
+
+class ExamVersion(models.Model):
+    """
+    Foto inmutable de un examen: ítems ordenados, opciones, puntajes y duración.
+    Los runners renderizan desde este payload (cacheado) en lugar de consultar
+    los ítems en cada carga. Cada recompilación crea una versión nueva.
+    """
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-number']
+        unique_together = ('exam', 'number')
+
+    def __str__(self):
+        return f"{self.exam} v{self.number}"
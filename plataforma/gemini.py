@@ -0,0 +1,381 @@
+"""
+Cliente único de Gemini para toda la plataforma (DNI del runner, IA del backoffice).
+
+Antes de cada llamada se toma un token de dos token buckets, el global y el del
+tenant, así una ráfaga de un tenant no agota la cuota de todos. Además hay un
+tope de llamadas simultáneas. Con Redis ambos límites son compartidos entre
+gunicorn y los workers de Celery (scripts Lua atómicos); sin Redis son por
+proceso. Cada llamada recorre la lista de modelos: un 429 abre el circuito de
+ese modelo y se pasa al siguiente; errores de red o 5xx se reintentan.
+stream()/stream_json_array() devuelven la respuesta a medida que se genera.
+
+GEMINI_BACKEND='stub' reemplaza la API por respuestas fijas (STUB_REPLIES, o las
+de settings.GEMINI_STUB_REPLIES), pasando igual por los límites: sirve para
+probar sin red ni cuota.
+"""
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from .redis_client import get_redis
+
+API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+STREAM_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent"
+TEXT_MODELS = ["gemini-2.5-flash-preview-09-2025", "gemini-2.0-flash"]
+DEFAULT_TIMEOUT = 30
+# Sin token o sin lugar libre, se espera hasta este tiempo antes de rendirse
+DEFAULT_MAX_WAIT = 5
+BREAKER_SECONDS = 60
+RETRIES = 1
+RETRY_BACKOFF = 0.5
+# Una llamada colgada no retiene su lugar más que esto (lease del semáforo)
+SLOT_LEASE_SECONDS = 120
+
+GLOBAL_BUCKET = 'gemini:bucket:global'
+SLOTS_KEY = 'gemini:slots'
+
+# Respuesta del stub por propósito: texto, o un código HTTP para simular errores.
+# El DNI no coincide con ningún legajo: para aprobarlo, fija el número en GEMINI_STUB_REPLIES
+STUB_REPLIES = {
+    'dni': '{"es_documento": true, "numeros": "00000000"}',
+    'distractors': '["Distractor 1", "Distractor 2", "Distractor 3"]',
+    'items': '[{"stem": "Pregunta de prueba", "correct_answer": "Correcta", "distractors": ["A", "B", "C"], "tags": "Prueba"}]',
+}
+
+
+class GeminiError(Exception):
+    def __init__(self, message, model=''):
+        super().__init__(message)
+        self.model = model
+
+
+class GeminiBlocked(GeminiError):
+    """La API no devolvió candidatos (contenido bloqueado)."""
+
+
+class GeminiQuotaExceeded(GeminiError):
+    """Todos los modelos con 429 / circuito abierto."""
+
+
+class GeminiRateLimited(GeminiQuotaExceeded):
+    """Límite propio (bucket o concurrencia) agotado sin llegar a llamar."""
+
+
+# --- Límites ---
+
+# Refill + consumo de todos los buckets juntos: o se descuenta de todos o de ninguno.
+# Devuelve los segundos a esperar hasta tener token ("0" = concedido).
+_TAKE_TOKENS = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 2])
+  local capacity = tonumber(ARGV[i * 2 + 1])
+  local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+  local current = tonumber(bucket[1]) or capacity
+  local ts = tonumber(bucket[2]) or now
+  current = math.min(capacity, current + math.max(0, now - ts) * rate)
+  tokens[i] = current
+  if current < 1 then wait = math.max(wait, (1 - current) / rate) end
+end
+if wait > 0 then return tostring(wait) end
+for i, key in ipairs(KEYS) do
+  redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+  redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[i * 2 + 1]) / tonumber(ARGV[i * 2])) + 1)
+end
+return '0'
+"""
+
+_ACQUIRE_SLOT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, tonumber(ARGV[1]) - tonumber(ARGV[3]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+  return 1
+end
+return 0
+"""
+
+_local_lock = threading.Lock()
+_local_buckets = {}
+_local_slots = None
+
+
+def _buckets(tenant_id):
+    """[(clave, tokens/seg, capacidad)] que tiene que pagar una llamada."""
+    buckets = [(GLOBAL_BUCKET, settings.GEMINI_GLOBAL_RPM / 60, settings.GEMINI_GLOBAL_BURST)]
+    if tenant_id:
+        buckets.append((f"gemini:bucket:tenant:{tenant_id}", settings.GEMINI_TENANT_RPM / 60, settings.GEMINI_TENANT_BURST))
+    return buckets
+
+
+def _try_take_tokens(buckets):
+    now = time.time()
+    client = get_redis()
+    if client is not None:
+        args = [now]
+        for _, rate, capacity in buckets:
+            args += [rate, capacity]
+        return float(client.eval(_TAKE_TOKENS, len(buckets), *[key for key, _, _ in buckets], *args))
+
+    with _local_lock:
+        wait, refilled = 0, []
+        for key, rate, capacity in buckets:
+            tokens, ts = _local_buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - ts) * rate)
+            refilled.append(tokens)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+        if wait:
+            return wait
+        for (key, _, _), tokens in zip(buckets, refilled):
+            _local_buckets[key] = (tokens - 1, now)
+        return 0
+
+
+def _take_tokens(tenant_id, deadline):
+    buckets = _buckets(tenant_id)
+    while True:
+        wait = _try_take_tokens(buckets)
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise GeminiRateLimited("Límite de uso de IA alcanzado. Intenta de nuevo en unos segundos.")
+        time.sleep(wait)
+
+
+@contextmanager
+def _concurrency_slot(deadline):
+    global _local_slots
+    client = get_redis()
+    limit = settings.GEMINI_MAX_CONCURRENCY
+    if client is not None:
+        token = uuid.uuid4().hex
+        while not client.eval(_ACQUIRE_SLOT, 1, SLOTS_KEY, time.time(), limit, SLOT_LEASE_SECONDS, token):
+            if time.monotonic() > deadline:
+                raise GeminiRateLimited("Demasiadas consultas de IA en curso. Intenta de nuevo en unos segundos.")
+            time.sleep(0.1)
+        try:
+            yield
+        finally:
+            client.zrem(SLOTS_KEY, token)
+        return
+
+    with _local_lock:
+        if _local_slots is None:
+            _local_slots = threading.BoundedSemaphore(limit)
+    if not _local_slots.acquire(timeout=max(0, deadline - time.monotonic())):
+        raise GeminiRateLimited("Demasiadas consultas de IA en curso. Intenta de nuevo en unos segundos.")
+    try:
+        yield
+    finally:
+        _local_slots.release()
+
+
+# --- Backends ---
+
+_session = None
+
+
+def _http():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return _session
+
+
+def _http_backend(model, payload, timeout, purpose):
+    r = _http().post(API_URL.format(model=model), params={'key': settings.GEMINI_API_KEY}, json=payload, timeout=timeout)
+    if r.status_code != 200:
+        return r.status_code, None
+    try:
+        return 200, r.json()
+    except ValueError as e:
+        raise GeminiError(f"Respuesta inválida: {str(e)}", model)
+
+
+def _http_stream_backend(model, payload, timeout, purpose):
+    r = _http().post(STREAM_URL.format(model=model), params={'key': settings.GEMINI_API_KEY, 'alt': 'sse'},
+                     json=payload, timeout=timeout, stream=True)
+    if r.status_code != 200:
+        r.close()
+        return r.status_code, None
+    return 200, _sse_chunks(r)
+
+
+def _sse_chunks(response):
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith('data:'):
+                yield json.loads(line[5:])
+
+
+def _stub_backend(model, payload, timeout, purpose):
+    reply = settings.GEMINI_STUB_REPLIES.get(purpose, STUB_REPLIES.get(purpose, '{}'))
+    if isinstance(reply, int):
+        return reply, None
+    return 200, {'candidates': [{'content': {'parts': [{'text': reply}]}}]}
+
+
+def _stub_stream_backend(model, payload, timeout, purpose):
+    status, data = _stub_backend(model, payload, timeout, purpose)
+    if status != 200:
+        return status, None
+    text = data['candidates'][0]['content']['parts'][0]['text']
+    return 200, ({'candidates': [{'content': {'parts': [{'text': text[i:i + 40]}]}}]} for i in range(0, len(text), 40))
+
+
+BACKENDS = {
+    'http': _http_backend,
+    'stub': _stub_backend,
+}
+
+# Igual que BACKENDS, pero devuelven un iterador de respuestas parciales
+STREAM_BACKENDS = {
+    'http': _http_stream_backend,
+    'stub': _stub_stream_backend,
+}
+
+
+def is_configured():
+    """Hay con qué llamar: API key, o el backend stub."""
+    return settings.GEMINI_BACKEND == 'stub' or bool(settings.GEMINI_API_KEY)
+
+
+# --- Llamadas ---
+
+def _breaker_key(model):
+    return f"gemini:breaker:{model}"
+
+
+def available_models(models):
+    """Modelos con el circuito cerrado (sin 429 reciente), en orden de preferencia."""
+    tripped = cache.get_many([_breaker_key(m) for m in models])
+    return [m for m in models if _breaker_key(m) not in tripped]
+
+
+def _response_text(data, model, image):
+    try:
+        cands = data.get('candidates', [])
+        if not cands:
+            raise GeminiBlocked("IA bloqueó la imagen" if image else "IA bloqueó el pedido", model)
+        return cands[0].get('content', {}).get('parts', [])[0].get('text', '')
+    except (IndexError, AttributeError) as e:
+        raise GeminiError(f"Respuesta inválida: {str(e)}", model)
+
+
+def _payload(prompt, image, json_response):
+    parts = [{"text": prompt}]
+    if image:
+        parts.append({"inline_data": {"mime_type": image[0], "data": image[1]}})
+    payload = {"contents": [{"parts": parts}]}
+    if json_response:
+        payload["generationConfig"] = {"responseMimeType": "application/json"}
+    return payload
+
+
+def _dispatch(backend, payload, tenant_id, purpose, models, timeout, deadline):
+    """Recorre los modelos (circuito, reintentos, tokens) hasta un 200. Devuelve (respuesta, modelo)."""
+    last_error = None
+    for model in available_models(models or TEXT_MODELS):
+        for attempt in range(RETRIES + 1):
+            _take_tokens(tenant_id, deadline)
+            try:
+                status, data = backend(model, payload, timeout, purpose)
+            except requests.RequestException as e:
+                last_error = GeminiError(f"Red: {str(e)}", model)
+            else:
+                if status == 200:
+                    return data, model
+                if status == 429:
+                    cache.set(_breaker_key(model), 1, BREAKER_SECONDS)
+                    break
+                last_error = GeminiError(f"Error API ({status})", model)
+                if status < 500:
+                    raise last_error
+            if attempt < RETRIES:
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    if last_error is None:
+        raise GeminiQuotaExceeded("Cuota de IA agotada")
+    raise last_error
+
+
+def generate(prompt, *, tenant_id=None, purpose='', models=None, image=None, json_response=False,
+             timeout=DEFAULT_TIMEOUT, max_wait=DEFAULT_MAX_WAIT):
+    """
+    Devuelve (texto, modelo). image = (mime_type, base64). Levanta GeminiError
+    (o una subclase) si ningún modelo pudo responder.
+    """
+    payload = _payload(prompt, image, json_response)
+    deadline = time.monotonic() + max_wait
+    with _concurrency_slot(deadline):
+        data, model = _dispatch(BACKENDS[settings.GEMINI_BACKEND], payload, tenant_id, purpose, models, timeout, deadline)
+    return _response_text(data, model, image), model
+
+
+def generate_json(prompt, **kwargs):
+    """Como generate, pero parsea la respuesta como JSON. Devuelve (datos, modelo)."""
+    text, model = generate(prompt, json_response=True, **kwargs)
+    try:
+        return json.loads(text.replace('```json', '').replace('```', '').strip()), model
+    except ValueError as e:
+        raise GeminiError(f"Respuesta inválida: {str(e)}", model)
+
+
+def stream(prompt, *, tenant_id=None, purpose='', models=None, json_response=False,
+           timeout=DEFAULT_TIMEOUT, max_wait=DEFAULT_MAX_WAIT):
+    """
+    Como generate, pero va devolviendo los fragmentos de texto a medida que
+    llegan. El fallback de modelo solo aplica antes del primer fragmento.
+    """
+    payload = _payload(prompt, None, json_response)
+    deadline = time.monotonic() + max_wait
+    with _concurrency_slot(deadline):
+        chunks, model = _dispatch(STREAM_BACKENDS[settings.GEMINI_BACKEND], payload, tenant_id, purpose, models, timeout, deadline)
+        try:
+            for data in chunks:
+                if not data.get('candidates'):
+                    raise GeminiBlocked("IA bloqueó el pedido", model)
+                yield ''.join(part.get('text', '') for part in data['candidates'][0].get('content', {}).get('parts', []))
+        except requests.RequestException as e:
+            raise GeminiError(f"Red: {str(e)}", model)
+        except ValueError as e:
+            raise GeminiError(f"Respuesta inválida: {str(e)}", model)
+
+
+def stream_json_array(prompt, **kwargs):
+    """
+    Pide un array JSON en streaming y devuelve cada elemento apenas está
+    completo, sin esperar el resto de la respuesta.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, started = '', 0, False
+    for chunk in stream(prompt, json_response=True, **kwargs):
+        buffer += chunk
+        if not started:
+            start = buffer.find('[')
+            if start < 0:
+                continue
+            pos, started = start + 1, True
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer) or buffer[pos] == ']':
+                break
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break  # Elemento todavía incompleto: esperar más texto
+            yield item
+        buffer, pos = buffer[pos:], 0
+    if not started:
+        raise GeminiError("Respuesta inválida: se esperaba un array JSON")
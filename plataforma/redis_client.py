@@ -0,0 +1,16 @@
+"""
+Cliente Redis crudo compartido (el mismo Redis del broker de Celery y del cache).
+Para estructuras que el cache de Django no expone: streams, hashes, MGET sin prefijos.
+"""
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """Cliente único por proceso; None si no hay Redis configurado (entorno local)."""
+    global _client
+    if _client is None and settings.REDIS_URL:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
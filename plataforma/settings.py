@@ -3,11 +3,12 @@ Configuración de Django para el proyecto Plataforma.
 Sprint S1c (v7): Integración de IA (Gemini)
 """
 
+import json
 import os
 from pathlib import Path
 import dj_database_url # Render usa esto
 import importlib # Para el logging
-import google.generativeai as genai # (S1c) Importamos la librería de IA
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -126,6 +127,54 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Sin broker (entorno local) las tareas corren en el mismo proceso
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+# Tareas periódicas (el worker corre con -B, ver render.yaml)
+CELERY_BEAT_SCHEDULE = {
+    'archive-event-partitions': {
+        'task': 'runner.tasks.archive_event_partitions',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'flush-event-stream': {
+        'task': 'runner.tasks.flush_event_stream',
+        'schedule': 30.0,
+    },
+    'flush-heartbeats': {
+        'task': 'runner.tasks.flush_heartbeats',
+        'schedule': 60.0,
+    },
+}
+# Los consumidores del stream de eventos corren en su propio worker
+CELERY_TASK_ROUTES = {
+    'runner.tasks.flush_event_stream': {'queue': 'events'},
+    # OCR del DNI: worker aparte con torch/easyocr y concurrencia acotada
+    'runner.tasks.verify_dni': {'queue': 'ocr'},
+}
+
+# Meses que los eventos de proctoring quedan en la base antes de archivarse
+EVENT_RETENTION_MONTHS = int(os.environ.get('EVENT_RETENTION_MONTHS', 6))
+# 'direct': los eventos se insertan en el request; 'stream': se encolan en Redis (ver runner.events)
+EVENT_INGEST_MODE = os.environ.get('EVENT_INGEST_MODE', 'direct')
+# OCR local del DNI (runner.ocr): 'easyocr' o '' para ir directo a Gemini
+DNI_OCR_BACKEND = os.environ.get('DNI_OCR_BACKEND', 'easyocr')
+# Pesos de EasyOCR: se descargan en el build (render.yaml), no en la primera validación
+EASYOCR_MODEL_DIR = os.environ.get('EASYOCR_MODEL_DIR', str(BASE_DIR / 'easyocr_models'))
+
+# --- Cache compartido (Redis si hay, memoria local si no) ---
+REDIS_URL = os.environ.get('REDIS_URL') or CELERY_BROKER_URL
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 # --- 2. Configuración de Storage (R2) ---
 CLOUDFLARE_R2_ACCOUNT_ID = os.environ.get('CLOUDFLARE_R2_ACCOUNT_ID')
@@ -133,6 +182,12 @@ CLOUDFLARE_R2_ACCESS_KEY_ID = os.environ.get('CLOUDFLARE_R2_ACCESS_KEY_ID')
 CLOUDFLARE_R2_SECRET_ACCESS_KEY = os.environ.get('CLOUDFLARE_R2_SECRET_ACCESS_KEY')
 CLOUDFLARE_R2_BUCKET_NAME = os.environ.get('CLOUDFLARE_R2_BUCKET_NAME')
 
+# Stand-in S3 local (ej. MinIO en http://localhost:9000) para desarrollo y tests
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+# Vida de las URLs pre-firmadas para subir evidencia directo al bucket (segundos)
+EVIDENCE_UPLOAD_URL_EXPIRES = int(os.environ.get('EVIDENCE_UPLOAD_URL_EXPIRES', 120))
+
 # Configuración para Build vs Runtime
 if os.environ.get('DJANGO_COLLECTSTATIC_RUNNING') == 'True':
     STORAGES = {
@@ -154,6 +209,25 @@ else:
         AWS_S3_SIGNATURE_VERSION = 's3v4'
         AWS_S3_REGION_NAME = 'auto' 
 
+        STORAGES = {
+            "default": {
+                "BACKEND": "storages.backends.s3.S3Storage",
+            },
+            "staticfiles": {
+                "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+            },
+        }
+    elif S3_ENDPOINT_URL:
+        AWS_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+        AWS_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+        AWS_STORAGE_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME', 'plataforma-local')
+        AWS_S3_ENDPOINT_URL = S3_ENDPOINT_URL
+        AWS_DEFAULT_ACL = 'private'
+        AWS_S3_FILE_OVERWRITE = False
+        AWS_S3_SIGNATURE_VERSION = 's3v4'
+        AWS_S3_REGION_NAME = os.environ.get('S3_REGION_NAME', 'us-east-1')
+        AWS_S3_ADDRESSING_STYLE = 'path' # MinIO no usa subdominios por bucket
+
         STORAGES = {
             "default": {
                 "BACKEND": "storages.backends.s3.S3Storage",
@@ -200,12 +274,20 @@ LOGIN_URL = '/accounts/login/'
 LOGOUT_REDIRECT_URL = '/'
 
 # --- 5. Configuración de IA (S1c - v7) ---
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-    except Exception as e:
-        print(f"Error al configurar la API de Gemini: {e}")
+# Todas las llamadas pasan por plataforma.gemini (límites compartidos vía Redis)
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '').strip()
+# 'http' (API real) o 'stub' (respuestas fijas, para pruebas sin red ni cuota)
+GEMINI_BACKEND = os.environ.get('GEMINI_BACKEND', 'http')
+# Con 'stub': respuestas por propósito que reemplazan a plataforma.gemini.STUB_REPLIES (JSON),
+# ej. {"dni": "{\"es_documento\": true, \"numeros\": \"30123456\"}"} o {"dni": 429}
+GEMINI_STUB_REPLIES = json.loads(os.environ.get('GEMINI_STUB_REPLIES') or '{}')
+# Token buckets: pedidos por minuto y ráfaga máxima, global y por tenant
+GEMINI_GLOBAL_RPM = int(os.environ.get('GEMINI_GLOBAL_RPM', 60))
+GEMINI_GLOBAL_BURST = int(os.environ.get('GEMINI_GLOBAL_BURST', 20))
+GEMINI_TENANT_RPM = int(os.environ.get('GEMINI_TENANT_RPM', 20))
+GEMINI_TENANT_BURST = int(os.environ.get('GEMINI_TENANT_BURST', 5))
+# Llamadas simultáneas a Gemini entre todos los procesos
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 8))
 
 # Si alguien intenta entrar al portal sin permiso, mandarlo aquí:
 LOGIN_URL = '/admin/login/'
@@ -0,0 +1,173 @@
+"""
+Cliente de Gemini sin red: límites (token buckets y concurrencia, locales y en
+Redis simulado con fakeredis), fallback entre modelos y backend stub.
+"""
+import time
+import unittest
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from plataforma import gemini
+
+try:
+    import fakeredis
+except ImportError:  # fakeredis es solo de desarrollo (requirements-dev.txt)
+    fakeredis = None
+
+LIMITS = dict(GEMINI_GLOBAL_RPM=60, GEMINI_GLOBAL_BURST=10, GEMINI_TENANT_RPM=60, GEMINI_TENANT_BURST=2,
+              GEMINI_MAX_CONCURRENCY=1, GEMINI_BACKEND='stub', GEMINI_STUB_REPLIES={})
+
+
+def fake_backend(replies):
+    """Backend que devuelve, por modelo, la siguiente respuesta de la lista (código HTTP o texto)."""
+    calls = []
+
+    def backend(model, payload, timeout, purpose):
+        calls.append(model)
+        reply = replies[model].pop(0)
+        if isinstance(reply, int):
+            return reply, None
+        return 200, {'candidates': [{'content': {'parts': [{'text': reply}]}}]}
+    return backend, calls
+
+
+@override_settings(**LIMITS)
+class LocalLimiterTests(SimpleTestCase):
+    """Sin Redis: buckets y semáforo por proceso."""
+
+    def setUp(self):
+        patcher = mock.patch.object(gemini, 'get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        gemini._local_buckets.clear()
+        gemini._local_slots = None
+        cache.clear()
+
+    def test_tenant_bucket_is_independent(self):
+        gemini.generate('hola', tenant_id=1, purpose='items', max_wait=0)
+        gemini.generate('hola', tenant_id=1, purpose='items', max_wait=0)
+        with self.assertRaises(gemini.GeminiRateLimited):
+            gemini.generate('hola', tenant_id=1, purpose='items', max_wait=0)
+        # Otro tenant tiene su propio bucket
+        gemini.generate('hola', tenant_id=2, purpose='items', max_wait=0)
+
+    def test_rate_limited_is_quota_subclass(self):
+        self.assertTrue(issubclass(gemini.GeminiRateLimited, gemini.GeminiQuotaExceeded))
+
+    def test_concurrency_cap(self):
+        deadline = time.monotonic()
+        with gemini._concurrency_slot(deadline):
+            with self.assertRaises(gemini.GeminiRateLimited):
+                with gemini._concurrency_slot(deadline):
+                    pass
+        with gemini._concurrency_slot(deadline):
+            pass
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis no instalado")
+@override_settings(**LIMITS)
+class RedisLimiterTests(SimpleTestCase):
+    """Con Redis: los scripts Lua comparten los límites entre procesos."""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(gemini, 'get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def test_tenant_bucket(self):
+        buckets = gemini._buckets(7)
+        self.assertEqual(gemini._try_take_tokens(buckets), 0)
+        self.assertEqual(gemini._try_take_tokens(buckets), 0)
+        # Ráfaga del tenant agotada: hay que esperar ~1 s (60 por minuto)
+        self.assertGreater(gemini._try_take_tokens(buckets), 0)
+        self.assertEqual(gemini._try_take_tokens(gemini._buckets(8)), 0)
+
+    def test_failed_take_does_not_spend_other_buckets(self):
+        for _ in range(2):
+            gemini._try_take_tokens(gemini._buckets(7))
+        global_tokens = float(self.redis.hget(gemini.GLOBAL_BUCKET, 'tokens'))
+        gemini._try_take_tokens(gemini._buckets(7))
+        self.assertEqual(float(self.redis.hget(gemini.GLOBAL_BUCKET, 'tokens')), global_tokens)
+
+    def test_concurrency_slot_is_released(self):
+        deadline = time.monotonic()
+        with gemini._concurrency_slot(deadline):
+            with self.assertRaises(gemini.GeminiRateLimited):
+                with gemini._concurrency_slot(deadline):
+                    pass
+        self.assertEqual(self.redis.zcard(gemini.SLOTS_KEY), 0)
+
+
+@override_settings(**dict(LIMITS, GEMINI_BACKEND='fake', GEMINI_TENANT_BURST=10))
+class FallbackTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(gemini, 'get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(gemini, 'RETRY_BACKOFF', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        gemini._local_buckets.clear()
+        gemini._local_slots = None
+        cache.clear()
+
+    def generate(self, replies):
+        backend, calls = fake_backend(replies)
+        with mock.patch.dict(gemini.BACKENDS, {'fake': backend}):
+            result = gemini.generate('hola', models=['a', 'b'], max_wait=0)
+        return result, calls
+
+    def test_429_opens_breaker_and_falls_back(self):
+        result, calls = self.generate({'a': [429], 'b': ['ok']})
+        self.assertEqual(result, ('ok', 'b'))
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual(gemini.available_models(['a', 'b']), ['b'])
+        # Con el circuito abierto 'a' ni se intenta
+        result, calls = self.generate({'a': ['no'], 'b': ['ok']})
+        self.assertEqual(calls, ['b'])
+
+    def test_server_error_is_retried(self):
+        result, calls = self.generate({'a': [503, 'ok'], 'b': []})
+        self.assertEqual(result, ('ok', 'a'))
+        self.assertEqual(calls, ['a', 'a'])
+
+    def test_client_error_is_not_retried(self):
+        with self.assertRaises(gemini.GeminiError) as ctx:
+            self.generate({'a': [400], 'b': ['ok']})
+        self.assertNotIsInstance(ctx.exception, gemini.GeminiQuotaExceeded)
+
+    def test_all_models_429_is_upstream_quota(self):
+        with self.assertRaises(gemini.GeminiQuotaExceeded) as ctx:
+            self.generate({'a': [429], 'b': [429]})
+        self.assertNotIsInstance(ctx.exception, gemini.GeminiRateLimited)
+
+
+@override_settings(**dict(LIMITS, GEMINI_TENANT_BURST=10))
+class StubTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(gemini, 'get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        gemini._local_buckets.clear()
+        gemini._local_slots = None
+        cache.clear()
+
+    def test_default_replies(self):
+        data, _ = gemini.generate_json('?', purpose='items', max_wait=0)
+        self.assertEqual(data[0]['stem'], 'Pregunta de prueba')
+        self.assertEqual(list(gemini.stream_json_array('?', purpose='distractors', max_wait=0)),
+                         ["Distractor 1", "Distractor 2", "Distractor 3"])
+
+    def test_settings_override(self):
+        with self.settings(GEMINI_STUB_REPLIES={'dni': '{"es_documento": true, "numeros": "30123456"}'}):
+            data, _ = gemini.generate_json('?', purpose='dni', max_wait=0)
+        self.assertEqual(data['numeros'], '30123456')
+
+    def test_status_code_reply(self):
+        with self.settings(GEMINI_STUB_REPLIES={'dni': 429}):
+            with self.assertRaises(gemini.GeminiQuotaExceeded):
+                gemini.generate('?', purpose='dni', max_wait=0)
@@ -0,0 +1,110 @@
+"""
+Archivo de eventos de intentos cerrados: JSONL comprimido (gzip) en el storage.
+
+Cuando todos los intentos con filas en una partición mensual vieja están
+archivados, la partición se borra entera (ver runner.partitions). La lectura
+es transparente: attempt_events() devuelve los eventos del intento desde la
+base o desde el archivo, según corresponda.
+"""
+import gzip
+import json
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Attempt, AttemptEvent
+from .partitions import (
+    add_months, month_start, ensure_event_partitions, list_event_partitions,
+    partition_attempt_ids, drop_event_partition, default_partition_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = 'archive/events'
+ARCHIVED_FIELDS = ('id', 'event_type', 'subtype', 'outcome', 'metadata', 'repeat_count', 'evidence_url')
+
+
+def archivable_attempts():
+    """Intentos cerrados y revisados, o de exámenes archivados; sin archivar todavía."""
+    return Attempt.objects.filter(events_archive_path__isnull=True).filter(
+        Q(exam__status='archived') | (Q(completed_at__isnull=False) & ~Q(review_status='pending'))
+    )
+
+
+def _serialize(event):
+    row = {field: getattr(event, field) for field in ARCHIVED_FIELDS}
+    row['timestamp'] = event.timestamp.isoformat()
+    row['ended_at'] = event.ended_at.isoformat() if event.ended_at else None
+    return json.dumps(row, ensure_ascii=False)
+
+
+def archive_attempt_events(attempt):
+    """Exporta todos los eventos del intento y guarda el path en el intento."""
+    events = AttemptEvent.objects.filter(attempt_id=attempt.id).order_by('timestamp', 'id')
+    lines = '\n'.join(_serialize(event) for event in events.iterator())
+    path = default_storage.save(
+        f"{ARCHIVE_PREFIX}/{attempt.exam_id}/{attempt.id}.jsonl.gz",
+        ContentFile(gzip.compress(lines.encode('utf-8')))
+    )
+    Attempt.objects.filter(id=attempt.id).update(events_archive_path=path)
+    attempt.events_archive_path = path
+    return path
+
+
+def load_archived_events(attempt):
+    """AttemptEvent sin guardar (con su id original), en orden (timestamp, id)."""
+    with default_storage.open(attempt.events_archive_path, 'rb') as f:
+        raw = gzip.decompress(f.read()).decode('utf-8')
+    events = []
+    for line in raw.splitlines():
+        if not line:
+            continue
+        row = json.loads(line)
+        event = AttemptEvent(attempt=attempt, **{field: row.get(field) for field in ARCHIVED_FIELDS})
+        event.timestamp = parse_datetime(row['timestamp'])
+        event.ended_at = parse_datetime(row['ended_at']) if row.get('ended_at') else None
+        events.append(event)
+    return events
+
+
+def attempt_events(attempt):
+    """Eventos del intento en orden (timestamp, id), estén en la base o archivados."""
+    if attempt.events_archive_path:
+        return load_archived_events(attempt)
+    return list(AttemptEvent.objects.filter(attempt=attempt).order_by('timestamp', 'id'))
+
+
+def archive_old_partitions(retention_months=None):
+    """
+    Crea las particiones de los próximos meses y borra las que superan la
+    retención, archivando antes sus intentos. Una partición con intentos que
+    todavía no se pueden archivar (sin revisar) se deja para la próxima corrida.
+    """
+    retention_months = retention_months or settings.EVENT_RETENTION_MONTHS
+    ensure_event_partitions()
+    cutoff = add_months(month_start(timezone.now()), -retention_months)
+
+    dropped = []
+    for name, month in list_event_partitions():
+        if add_months(month, 1) > cutoff:
+            break
+        attempt_ids = partition_attempt_ids(name)
+        for attempt in archivable_attempts().filter(id__in=attempt_ids).only('id', 'exam_id'):
+            archive_attempt_events(attempt)
+
+        pending = Attempt.objects.filter(id__in=attempt_ids, events_archive_path__isnull=True).count()
+        if pending:
+            logger.info("Partición %s conservada: %s intentos sin revisar", name, pending)
+            continue
+        drop_event_partition(name)
+        dropped.append(name)
+
+    stray = default_partition_rows()
+    if stray:
+        logger.warning("Hay %s eventos en la partición default: faltó crear su partición mensual", stray)
+    return dropped
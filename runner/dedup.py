@@ -0,0 +1,109 @@
+"""
+Deduplicación de capturas de incidentes por hash perceptual (dHash).
+
+El detectLoop manda una foto por segundo mientras dura el incidente: si una
+captura es casi idéntica a otra reciente del mismo intento, no la guardamos;
+la evidencia existente suma un duplicado y las referencias apuntan a ella.
+"""
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.cache import cache
+from django.db.models import F, Q
+from PIL import Image
+
+from .models import AttemptEvent, Evidence
+
+HASH_SIZE = 8
+# Solo comparamos contra capturas recientes del intento
+DEDUP_WINDOW_SECONDS = 120
+DEDUP_MAX_CANDIDATES = 10
+# Bits distintos (sobre 64) tolerados para considerar dos capturas iguales
+DEDUP_MAX_DISTANCE = 6
+# Claves de metadata de AttemptEvent que referencian evidencia
+EVIDENCE_PATH_KEYS = ('evidence_path', 'last_evidence_path')
+# Cubre eventos que siguen en el stream (incluye reclamos de consumidores caídos)
+EVIDENCE_REDIRECT_TTL = 60 * 60
+
+
+def dhash(image_bytes):
+    """dHash: compara el brillo de píxeles vecinos en una miniatura de 9x8 en grises."""
+    with Image.open(BytesIO(image_bytes)) as img:
+        pixels = list(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def hamming(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def _redirect_key(path):
+    return f"evidence_redirect:{path}"
+
+
+def replace_evidence_reference(attempt_id, old_path, new_path):
+    """
+    Reescribe los eventos que apuntaban a old_path (evidencia inicial o final del intervalo).
+    En modo stream el evento puede no estar todavía en la base: la redirección
+    queda en el cache y drain_event_stream la aplica al escribirlo.
+    """
+    cache.set(_redirect_key(old_path), new_path or '', EVIDENCE_REDIRECT_TTL)
+    events = AttemptEvent.objects.filter(attempt_id=attempt_id).filter(
+        Q(metadata__evidence_path=old_path) | Q(metadata__last_evidence_path=old_path)
+    )
+    for event in events:
+        for key in EVIDENCE_PATH_KEYS:
+            if event.metadata.get(key) == old_path:
+                event.metadata[key] = new_path
+        event.save(update_fields=['metadata'])
+
+
+def evidence_redirects(paths):
+    """{path_provisorio: path_final (None si la imagen se descartó)} de los que fueron redirigidos."""
+    paths = {path for path in paths if path}
+    if not paths:
+        return {}
+    found = cache.get_many([_redirect_key(path) for path in paths])
+    return {path: found[_redirect_key(path)] or None for path in paths if _redirect_key(path) in found}
+
+
+def dedupe_evidence(evidence_id, image_bytes):
+    """
+    Devuelve (path_original, phash). Si hay una captura casi idéntica anterior
+    del mismo intento, borra la nueva, suma un duplicado a la existente y
+    devuelve su path. Si no, devuelve (None, phash): quien sube la imagen
+    guarda el hash recién cuando la subida terminó, así nunca se deduplica
+    contra un original que no llegó al storage.
+    """
+    evidence = Evidence.objects.filter(id=evidence_id).only('id', 'attempt_id', 'file_url', 'timestamp').first()
+    if not evidence:
+        return None, None
+    try:
+        phash = dhash(image_bytes)
+    except Exception:
+        # Imagen ilegible: se guarda igual, sin deduplicar
+        return None, None
+
+    # Solo contra capturas anteriores: dos tareas concurrentes nunca se eligen mutuamente
+    candidates = Evidence.objects.filter(
+        Q(timestamp__lt=evidence.timestamp) | Q(timestamp=evidence.timestamp, id__lt=evidence.id),
+        attempt_id=evidence.attempt_id,
+        phash__isnull=False,
+        kind=Evidence.KIND_INCIDENT,
+        timestamp__gte=evidence.timestamp - timedelta(seconds=DEDUP_WINDOW_SECONDS),
+    ).order_by('-timestamp').values_list('id', 'phash', 'file_url')[:DEDUP_MAX_CANDIDATES]
+
+    for original_id, original_hash, original_path in candidates:
+        if hamming(phash, original_hash) <= DEDUP_MAX_DISTANCE:
+            Evidence.objects.filter(id=original_id).update(duplicate_count=F('duplicate_count') + 1)
+            evidence.delete()
+            replace_evidence_reference(evidence.attempt_id, evidence.file_url, original_path)
+            return original_path, phash
+
+    return None, phash
@@ -0,0 +1,99 @@
+"""
+Verificación del DNI con Gemini, fuera del request (ver runner.tasks.verify_dni).
+
+El gate solo encola y después consulta el estado guardado en
+Evidence.gemini_analysis. Las llamadas pasan por plataforma.gemini (límites
+por tenant, circuito por modelo y reintentos). Lo que leyó cada modelo queda
+cacheado por contenido de la imagen (runner.verdicts).
+"""
+import base64
+import re
+
+from plataforma import gemini
+from .verdicts import get_verdicts, image_digest, store_verdict
+
+DNI_MODELS = ["gemini-flash-lite-latest", "gemini-2.0-flash-lite", "gemini-2.0-flash"]
+DNI_TIMEOUT = 10
+# Corre en el worker: puede esperar más que un request a que se libere cuota
+DNI_MAX_WAIT = 30
+MAX_DNI_ATTEMPTS = 3
+# Límite propio de Gemini agotado: la verificación se reencola (sigue 'procesando')
+DNI_RATE_LIMIT_RETRIES = 4
+DNI_RATE_LIMIT_COUNTDOWN = 15
+
+DNI_PROMPT = "Analiza esta imagen. Responde SOLO JSON: {\"es_documento\": true, \"numeros\": \"123456\"}. Si no es DNI, false."
+# Subirla al cambiar el prompt: invalida los veredictos cacheados (runner.verdicts)
+DNI_PROMPT_VERSION = 1
+
+
+def legajo_matches(numbers, legajo):
+    """Alguno de los números leídos coincide con el legajo/DNI declarado (solo dígitos)."""
+    legajo = re.sub(r'[^0-9]', '', str(legajo))
+    return bool(legajo) and any(n and (legajo in n or n in legajo) for n in numbers)
+
+
+def check_dni(base64_clean, legajo, tenant_id=None):
+    """
+    Devuelve (ok, error, modelo, force_manual). force_manual = ningún modelo
+    disponible (todos con cuota agotada): el intento pasa a revisión manual.
+    Si el que frena es el límite propio (GeminiRateLimited) la excepción sube:
+    verify_dni reencola la verificación en vez de darla por fallida.
+    """
+    # La misma foto ya analizada (reintento del alumno) no vuelve a llamar a la API
+    try:
+        digest = image_digest(base64.b64decode(base64_clean))
+    except ValueError:
+        return False, "Imagen ilegible", '', False
+    cached = get_verdicts([_verdict_backend(m) for m in DNI_MODELS], digest)
+    for model in DNI_MODELS:
+        if _verdict_backend(model) in cached:
+            return _verdict_result(cached[_verdict_backend(model)], legajo, model)
+
+    try:
+        ai_data, model = gemini.generate_json(
+            DNI_PROMPT, tenant_id=tenant_id, purpose='dni', models=DNI_MODELS,
+            image=('image/jpeg', base64_clean), timeout=DNI_TIMEOUT, max_wait=DNI_MAX_WAIT,
+        )
+    except gemini.GeminiRateLimited:
+        raise
+    except gemini.GeminiQuotaExceeded as e:
+        return False, str(e), e.model, True
+    except gemini.GeminiError as e:
+        return False, str(e), e.model, False
+    if not isinstance(ai_data, dict):
+        return False, "Respuesta inválida", model, False
+
+    verdict = {
+        'es_documento': bool(ai_data.get('es_documento')),
+        'numeros': str(ai_data.get('numeros', '')),
+    }
+    store_verdict(_verdict_backend(model), digest, verdict)
+    return _verdict_result(verdict, legajo, model)
+
+
+def _verdict_backend(model):
+    return f"gemini:{model}:v{DNI_PROMPT_VERSION}"
+
+
+def _verdict_result(verdict, legajo, model):
+    if not verdict['es_documento']:
+        return False, "No es DNI válido", model, False
+    nums = verdict['numeros']
+    if legajo_matches([nums], legajo):
+        return True, "", model, False
+    return False, f"Legajo no coincide ({nums})", model, False
+
+
+def dni_status_response(analysis):
+    """Respuesta del endpoint de estado a partir de Evidence.gemini_analysis."""
+    status = (analysis or {}).get('status')
+    if status in (None, 'procesando'):
+        return {'done': False}
+    if status == 'success':
+        return {'done': True, 'success': True, 'message': analysis.get('message') or 'Identidad verificada.'}
+    if status == 'manual_review':
+        return {'done': True, 'success': True, 'warning': True, 'message': 'Pase a revisión manual.', 'retry': False}
+    return {
+        'done': True, 'success': False, 'retry': status == 'retry',
+        'message': f"Fallo: {analysis.get('error', '')}. Reintentando..." if status == 'retry' else analysis.get('error', 'Error'),
+    }
@@ -0,0 +1,386 @@
+"""
+Ingesta de eventos de proctoring (AttemptEvent).
+Centraliza la validación de los eventos que manda el runner para que
+log_event y el endpoint en lote escriban exactamente lo mismo.
+"""
+import json
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from plataforma.redis_client import get_redis
+from tenancy.models import Tenant
+from .dedup import EVIDENCE_PATH_KEYS, evidence_redirects, replace_evidence_reference
+from .models import Attempt, AttemptEvent, add_risk_units, counts_for_risk
+
+logger = logging.getLogger(__name__)
+
+# Tope de eventos por request (el runner vacía su cola cada pocos segundos)
+MAX_BATCH_EVENTS = 100
+
+VALID_EVENT_TYPES = {code for code, _ in AttemptEvent.EVENT_TYPES}
+
+# El detectLoop del runner los repite ~1 vez por segundo mientras dura la condición:
+# repeticiones consecutivas se guardan como un único intervalo
+COALESCED_EVENT_TYPES = ('NO_FACE', 'MULTI_FACE', 'IDENTITY_MISMATCH')
+# Más de este silencio entre repeticiones abre un intervalo nuevo
+COALESCE_GAP_SECONDS = 5
+# El runner junta eventos hasta FLUSH_INTERVAL_MS (5 s) antes de mandarlos: el
+# client_ts se acepta si cae en esa ventana (+ tolerancia de reloj/red) antes del request
+EVENT_FLUSH_SECONDS = 5
+CLIENT_TS_TOLERANCE_SECONDS = 5
+
+
+def parse_client_timestamp(value):
+    """
+    Acepta ISO-8601 (Date.toISOString) o epoch en milisegundos (Date.now).
+    Devuelve un datetime con zona (UTC si no la trae) o None si no se puede interpretar.
+    """
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    try:
+        parsed = parse_datetime(str(value))
+    except ValueError:
+        return None
+    if parsed and timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def event_timestamp(client_ts, now):
+    """
+    Momento del evento: el client_ts acotado a [now - ventana de envío, now].
+    Un reloj adelantado no genera eventos en el futuro y uno atrasado no los
+    corre más allá de lo que el runner pudo tenerlos en cola.
+    """
+    if client_ts is None:
+        return now
+    earliest = now - timedelta(seconds=EVENT_FLUSH_SECONDS + CLIENT_TS_TOLERANCE_SECONDS)
+    return max(earliest, min(client_ts, now))
+
+
+def build_event(attempt_id, raw):
+    """
+    Valida un evento crudo del cliente y devuelve un AttemptEvent SIN guardar.
+    Lanza ValueError si el evento no es válido.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Evento mal formado")
+
+    event_type = raw.get('event_type')
+    if event_type not in VALID_EVENT_TYPES:
+        raise ValueError(f"Tipo de evento desconocido: {event_type}")
+
+    metadata = raw.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        raise ValueError("metadata debe ser un objeto")
+
+    client_ts = parse_client_timestamp(raw.get('client_ts'))
+    if client_ts:
+        metadata['client_ts'] = client_ts.isoformat()
+
+    # Clave de idempotencia: la del cliente (reintentos) o una nueva por evento
+    idempotency_key = raw.get('idempotency_key')
+    if not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= 64:
+        idempotency_key = uuid.uuid4().hex
+
+    # timestamp = cuándo pasó en el cliente (acotado), no cuándo llegó el lote; se fija
+    # acá aunque la escritura se difiera (ver record_events)
+    event = AttemptEvent(
+        attempt_id=attempt_id, event_type=event_type, metadata=metadata,
+        idempotency_key=idempotency_key, timestamp=event_timestamp(client_ts, timezone.now()),
+    )
+    event.classify()
+    return event
+
+
+# --- FUSIÓN DE INCIDENTES REPETIDOS EN INTERVALOS ---
+# El intervalo abierto de cada intento vive en el cache:
+# {id, key, start, last, units, unit_seconds}. Si el cache se pierde, lo peor
+# que pasa es que el próximo incidente abre un intervalo nuevo.
+
+def _open_interval_key(attempt_id):
+    return f"open_interval:{attempt_id}"
+
+
+def _coalesce_key(event):
+    if event.event_type not in COALESCED_EVENT_TYPES:
+        return None
+    # Los reintentos de DNI ('Fallo ...') no se mezclan con suplantaciones reales
+    return [event.event_type, counts_for_risk(event)]
+
+
+def _merge_into(event, repeated):
+    event.repeat_count += 1
+    # Con timestamps del cliente, un lote atrasado no puede acortar el intervalo
+    event.ended_at = max(event.ended_at or event.timestamp, repeated.timestamp)
+    if repeated.metadata.get('evidence_path'):
+        event.metadata['last_evidence_path'] = repeated.metadata['evidence_path']
+
+
+def ingest_events(attempt_id, events):
+    """
+    Guarda eventos (sin guardar, de build_event) fusionando repeticiones
+    consecutivas del mismo incidente en una sola fila: timestamp = inicio,
+    ended_at = fin, repeat_count, evidencia inicial (evidence_path) y final
+    (last_evidence_path). Devuelve las filas nuevas insertadas.
+    Los tiempos salen del timestamp de cada evento (client_ts acotado, ver
+    build_event), así da lo mismo si se escriben en el request o más tarde
+    desde el stream.
+    """
+    if not events:
+        return []
+    open_interval = cache.get(_open_interval_key(attempt_id))
+    if open_interval and (events[0].timestamp - datetime.fromisoformat(open_interval['last'])).total_seconds() > COALESCE_GAP_SECONDS:
+        open_interval = None
+
+    new_rows = []
+    current = open_interval  # intervalo abierto en la base (dict) o fila nueva de este lote (AttemptEvent)
+    merged = {'count': 0, 'last_evidence_path': None, 'last': None}
+    for event in events:
+        key = _coalesce_key(event)
+        current_key = current.coalesce_key if isinstance(current, AttemptEvent) else (current or {}).get('key')
+        if key is not None and key == current_key:
+            if isinstance(current, AttemptEvent):
+                _merge_into(current, event)
+            else:
+                merged['count'] += 1
+                merged['last'] = max(merged['last'] or event.timestamp, event.timestamp)
+                merged['last_evidence_path'] = event.metadata.get('evidence_path') or merged['last_evidence_path']
+            continue
+        new_rows.append(event)
+        event.coalesce_key = key
+        current = event if key is not None else None
+
+    if merged['count']:
+        _extend_open_interval(attempt_id, open_interval, merged)
+
+    if new_rows:
+        AttemptEvent.objects.bulk_create(new_rows)
+
+    if isinstance(current, AttemptEvent):
+        unit_seconds = Tenant.objects.filter(exams__attempts=attempt_id).values_list('risk_interval_seconds', flat=True).first() or 0
+        cache.set(_open_interval_key(attempt_id), {
+            'id': current.id, 'key': current.coalesce_key, 'start': current.timestamp.isoformat(),
+            'last': (current.ended_at or current.timestamp).isoformat(), 'units': 0, 'unit_seconds': unit_seconds,
+        }, COALESCE_GAP_SECONDS * 12)
+    elif current is None:
+        cache.delete(_open_interval_key(attempt_id))
+    return new_rows
+
+
+def _extend_open_interval(attempt_id, interval, merged):
+    """Un UPDATE sobre la fila del intervalo abierto; suma unidades de riesgo por duración si corresponde."""
+    now = max(merged['last'], datetime.fromisoformat(interval['last']))
+    updates = {'repeat_count': F('repeat_count') + merged['count'], 'ended_at': now}
+    if merged['last_evidence_path']:
+        # Merge de una sola clave en el JSONB, sin leer la fila
+        updates['metadata'] = RawSQL(
+            "COALESCE(metadata, '{}'::jsonb) || jsonb_build_object('last_evidence_path', %s::text)",
+            (merged['last_evidence_path'],)
+        )
+    AttemptEvent.objects.filter(id=interval['id']).update(**updates)
+
+    interval['last'] = now.isoformat()
+    if interval['unit_seconds'] and interval['key'][1]:
+        duration = (now - datetime.fromisoformat(interval['start'])).total_seconds()
+        units = int(duration // interval['unit_seconds'])
+        add_risk_units(attempt_id, interval['key'][0], units - interval['units'])
+        interval['units'] = units
+    cache.set(_open_interval_key(attempt_id), interval, COALESCE_GAP_SECONDS * 12)
+
+
+# --- INGESTA DIFERIDA POR REDIS STREAM (EVENT_INGEST_MODE = 'stream') ---
+# El request solo hace XADD; los workers de la cola 'events' leen con un
+# consumer group y escriben en lotes. Entrega al-menos-una-vez: un mensaje
+# se confirma (XACK) recién después de escribirlo, y los que quedaron sin
+# confirmar por un worker caído se reclaman con XAUTOCLAIM. Las filas ya
+# escritas se descartan por idempotency_key; una repetición que se fusionó en
+# un intervalo puede sumarse dos veces a repeat_count (inofensivo). Los paths
+# de evidencia que cambiaron mientras el evento esperaba (renombre del storage,
+# deduplicación) se corrigen al drenar (runner.dedup.evidence_redirects).
+EVENT_STREAM = 'runner:events'
+EVENT_STREAM_GROUP = 'runner-ingest'
+# Tope aproximado del stream (los mensajes confirmados se recortan solos)
+EVENT_STREAM_MAXLEN = 1_000_000
+STREAM_READ_COUNT = 1000
+STREAM_CLAIM_IDLE_MS = 60_000
+
+
+def stream_enabled():
+    return settings.EVENT_INGEST_MODE == 'stream' and bool(settings.REDIS_URL)
+
+
+def _event_message(event):
+    return json.dumps({
+        'attempt_id': str(event.attempt_id),
+        'event_type': event.event_type,
+        'subtype': event.subtype,
+        'outcome': event.outcome,
+        'metadata': event.metadata,
+        'timestamp': event.timestamp.isoformat(),
+        'idempotency_key': event.idempotency_key,
+    })
+
+
+def _event_from_message(raw):
+    data = json.loads(raw)
+    event = AttemptEvent(
+        attempt_id=data['attempt_id'], event_type=data['event_type'],
+        subtype=data.get('subtype') or '', outcome=data.get('outcome') or '',
+        metadata=data.get('metadata') or {}, idempotency_key=data['idempotency_key'],
+        timestamp=datetime.fromisoformat(data['timestamp']),
+    )
+    event.classify()
+    return event
+
+
+def enqueue_events(events):
+    pipe = get_redis().pipeline(transaction=False)
+    for event in events:
+        pipe.xadd(EVENT_STREAM, {'e': _event_message(event)}, maxlen=EVENT_STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+
+
+def record_events(attempt_id, events):
+    """
+    Punto de entrada de los views. En modo stream encola y devuelve [] (la
+    escritura la hace drain_event_stream); si Redis no responde, o en modo
+    directo, escribe en el request con ingest_events.
+    """
+    if events and stream_enabled():
+        try:
+            enqueue_events(events)
+            return []
+        except redis.RedisError as e:
+            logger.warning("Stream de eventos no disponible, escritura directa: %s", e)
+    return ingest_events(attempt_id, events)
+
+
+def _ensure_group(client):
+    try:
+        client.xgroup_create(EVENT_STREAM, EVENT_STREAM_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def drain_event_stream(block_ms=1000, count=STREAM_READ_COUNT):
+    """
+    Lee un lote del stream (primero lo pendiente de consumidores caídos),
+    lo escribe por intento con ingest_events y lo confirma. Devuelve la
+    cantidad de mensajes procesados.
+    """
+    client = get_redis()
+    consumer = f"{socket.gethostname()}:{os.getpid()}"
+    _ensure_group(client)
+
+    messages = client.xautoclaim(
+        EVENT_STREAM, EVENT_STREAM_GROUP, consumer, STREAM_CLAIM_IDLE_MS, '0-0', count=count
+    )[1]
+    if not messages:
+        response = client.xreadgroup(EVENT_STREAM_GROUP, consumer, {EVENT_STREAM: '>'}, count=count, block=block_ms)
+        messages = response[0][1] if response else []
+    if not messages:
+        return 0
+
+    raw_by_id = {}
+    by_attempt = defaultdict(list)
+    for message_id, fields in messages:
+        try:
+            event = _event_from_message(fields[b'e'])
+        except (KeyError, TypeError, ValueError) as e:
+            # Ilegible para siempre: se confirma para que no vuelva a entregarse
+            logger.error("Mensaje de evento inválido %s: %s", message_id, e)
+            continue
+        raw_by_id[message_id] = fields[b'e']
+        by_attempt[event.attempt_id].append((message_id, event))
+
+    events = [event for group in by_attempt.values() for _, event in group]
+    pending = set()  # sin confirmar: se reintentan (XAUTOCLAIM)
+    if events:
+        # La clave única es (idempotency_key, timestamp): filtrar por timestamp poda particiones
+        seen = set(AttemptEvent.objects.filter(
+            idempotency_key__in=[e.idempotency_key for e in events],
+            timestamp__gte=min(e.timestamp for e in events),
+        ).values_list('idempotency_key', flat=True))
+        redirects = _apply_evidence_redirects(events)
+
+        for attempt_id, group in by_attempt.items():
+            group = sorted(((m, e) for m, e in group if e.idempotency_key not in seen), key=lambda item: item[1].timestamp)
+            try:
+                with transaction.atomic():
+                    ingest_events(attempt_id, [event for _, event in group])
+            except IntegrityError as e:
+                # Carrera con otro consumidor (XAUTOCLAIM) o intento borrado: de a uno,
+                # así un conflicto no se lleva puestos los eventos nuevos del lote
+                logger.warning("Lote del intento %s con conflicto, se reintenta de a uno: %s", attempt_id, e)
+                pending |= _ingest_one_by_one(attempt_id, [(m, _event_from_message(raw_by_id[m])) for m, _ in group], redirects)
+            _late_evidence_redirects(attempt_id, [event for _, event in group], redirects)
+
+    acked = [message_id for message_id, _ in messages if message_id not in pending]
+    if acked:
+        client.xack(EVENT_STREAM, EVENT_STREAM_GROUP, *acked)
+    return len(messages)
+
+
+def _ingest_one_by_one(attempt_id, group, redirects):
+    """
+    Respaldo tras un IntegrityError del lote: cada evento en su propio savepoint.
+    Devuelve los message_id que no se pudieron escribir (quedan sin confirmar).
+    """
+    if not Attempt.objects.filter(id=attempt_id).exists():
+        logger.error("Intento %s inexistente: se descartan %s eventos", attempt_id, len(group))
+        return set()
+    _apply_evidence_redirects([event for _, event in group], redirects)
+    failed = set()
+    for message_id, event in group:
+        try:
+            with transaction.atomic():
+                ingest_events(attempt_id, [event])
+        except IntegrityError as e:
+            if AttemptEvent.objects.filter(idempotency_key=event.idempotency_key, timestamp=event.timestamp).exists():
+                continue  # Ya lo escribió otro consumidor
+            logger.error("Evento %s del intento %s sin escribir: %s", message_id, attempt_id, e)
+            failed.add(message_id)
+    return failed
+
+
+def _apply_evidence_redirects(events, redirects=None):
+    """
+    Aplica a metadata los paths definitivos de la evidencia (renombre del storage
+    o deduplicación) que se resolvieron mientras el evento esperaba en el stream.
+    """
+    if redirects is None:
+        redirects = evidence_redirects(
+            event.metadata.get(key) for event in events for key in EVIDENCE_PATH_KEYS
+        )
+    for event in events:
+        for key in EVIDENCE_PATH_KEYS:
+            if event.metadata.get(key) in redirects:
+                event.metadata[key] = redirects[event.metadata[key]]
+    return redirects
+
+
+def _late_evidence_redirects(attempt_id, events, redirects):
+    """Redirecciones que llegaron entre la lectura del cache y el INSERT: se aplican sobre las filas."""
+    paths = {event.metadata.get(key) for event in events for key in EVIDENCE_PATH_KEYS} - set(redirects)
+    for old_path, new_path in evidence_redirects(paths).items():
+        replace_evidence_reference(attempt_id, old_path, new_path)
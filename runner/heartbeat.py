@@ -0,0 +1,73 @@
+"""
+Heartbeat del alumno ("sigue conectado") sin escribir en la base por cada latido.
+
+Cada latido es un SET con TTL (heartbeat:<attempt_id>) más un HSET en el hash
+de pendientes, en un solo round-trip a Redis. flush_heartbeats (beat, cada
+minuto) pasa el último latido de cada intento a Attempt.last_heartbeat con un
+único bulk_update. Sin Redis (entorno local) se usa el cache de Django y se
+escribe en la base como máximo una vez por HEARTBEAT_FLUSH_SECONDS.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from plataforma.redis_client import get_redis
+from .models import Attempt
+
+# Sin latido en este lapso el alumno deja de figurar "en línea"
+HEARTBEAT_TTL = 45
+HEARTBEAT_FLUSH_SECONDS = 60
+PENDING_HASH = 'heartbeat:pending'
+PROCESSING_HASH = 'heartbeat:processing'
+
+
+def _key(attempt_id):
+    return f"heartbeat:{attempt_id}"
+
+
+def record_heartbeat(attempt_id):
+    now = timezone.now().isoformat()
+    client = get_redis()
+    if client is not None:
+        pipe = client.pipeline(transaction=False)
+        pipe.set(_key(attempt_id), now, ex=HEARTBEAT_TTL)
+        pipe.hset(PENDING_HASH, str(attempt_id), now)
+        pipe.execute()
+        return
+
+    cache.set(_key(attempt_id), now, HEARTBEAT_TTL)
+    if cache.add(f"{_key(attempt_id)}:db", 1, HEARTBEAT_FLUSH_SECONDS):
+        Attempt.objects.filter(id=attempt_id).update(last_heartbeat=now)
+
+
+def online_attempt_ids(attempt_ids):
+    """Subconjunto de attempt_ids con un latido vigente (un solo MGET)."""
+    attempt_ids = [str(attempt_id) for attempt_id in attempt_ids]
+    if not attempt_ids:
+        return set()
+    client = get_redis()
+    if client is not None:
+        values = client.mget([_key(attempt_id) for attempt_id in attempt_ids])
+        return {attempt_id for attempt_id, value in zip(attempt_ids, values) if value}
+    found = cache.get_many([_key(attempt_id) for attempt_id in attempt_ids])
+    return {attempt_id for attempt_id in attempt_ids if _key(attempt_id) in found}
+
+
+def flush_heartbeats():
+    """Vuelca los latidos pendientes a la base. Devuelve la cantidad de intentos actualizados."""
+    client = get_redis()
+    if client is None:
+        return 0
+    # RENAME es atómico: los latidos que lleguen durante el volcado van a un hash nuevo
+    if not client.exists(PENDING_HASH):
+        return 0
+    client.rename(PENDING_HASH, PROCESSING_HASH)
+    pending = client.hgetall(PROCESSING_HASH)
+    client.delete(PROCESSING_HASH)
+
+    attempts = [
+        Attempt(id=attempt_id.decode(), last_heartbeat=parse_datetime(value.decode()))
+        for attempt_id, value in pending.items()
+    ]
+    Attempt.objects.bulk_update(attempts, ['last_heartbeat'], batch_size=1000)
+    return len(attempts)
@@ -0,0 +1,57 @@
+"""
+Claves de idempotencia para las APIs de escritura del runner.
+
+El cliente manda un header Idempotency-Key (uno por operación lógica, el
+mismo en cada reintento). La primera respuesta queda en el cache unos
+minutos; los reintentos la reciben tal cual, sin tocar base ni storage.
+"""
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+IDEMPOTENCY_TTL = 60 * 10
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 128
+# Marca de "en curso": un reintento que llega mientras el original todavía corre
+IN_FLIGHT = 'in-flight'
+
+
+def _cache_key(view_name, attempt_id, key):
+    return f"idempotency:{view_name}:{attempt_id}:{key}"
+
+
+def idempotent(view):
+    @wraps(view)
+    def wrapper(request, attempt_id, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return view(request, attempt_id, *args, **kwargs)
+
+        cache_key = _cache_key(view.__name__, attempt_id, key)
+        if not cache.add(cache_key, IN_FLIGHT, IDEMPOTENCY_TTL):
+            stored = cache.get(cache_key)
+            if stored == IN_FLIGHT:
+                return JsonResponse({'status': 'pending', 'message': 'Operación en curso.'}, status=409)
+            if stored:
+                response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+        try:
+            response = view(request, attempt_id, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        if response.status_code >= 500:
+            # Error del servidor: el reintento tiene que poder ejecutarse de nuevo
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                'status': response.status_code,
+                'content': response.content,
+                'content_type': response.get('Content-Type'),
+            }, IDEMPOTENCY_TTL)
+        return response
+    return wrapper
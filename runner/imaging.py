@@ -0,0 +1,50 @@
+"""
+Normalización de imágenes de evidencia y miniaturas (Pillow).
+
+Las capturas llegan con el tamaño y la calidad que haya elegido el navegador:
+antes de guardarlas las acotamos, recomprimimos y les quitamos el EXIF, y
+generamos una miniatura liviana para la página de revisión.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+MAX_DIMENSIONS = (1280, 1280)
+JPEG_QUALITY = 80
+THUMBNAIL_DIMENSIONS = (320, 240)
+THUMBNAIL_QUALITY = 70
+
+
+def _to_jpeg(img, size, quality):
+    # exif_transpose aplica la rotación antes de descartar el EXIF
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    # Sin exif=...: Pillow no copia los metadatos al re-guardar
+    img.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def normalize_image(image_bytes):
+    """Devuelve (imagen normalizada, miniatura) como JPEG. Lanza si la imagen es ilegible."""
+    with Image.open(BytesIO(image_bytes)) as img:
+        img.load()
+        # JPEG sin EXIF y dentro del tamaño máximo: puede quedar tal cual si pesa menos
+        clean_original = (
+            img.format == 'JPEG' and not img.getexif()
+            and img.width <= MAX_DIMENSIONS[0] and img.height <= MAX_DIMENSIONS[1]
+        )
+        normalized = _to_jpeg(img, MAX_DIMENSIONS, JPEG_QUALITY)
+        thumbnail = _to_jpeg(img, THUMBNAIL_DIMENSIONS, THUMBNAIL_QUALITY)
+    if clean_original and len(image_bytes) <= len(normalized):
+        normalized = image_bytes
+    return normalized, thumbnail
+
+
+def thumbnail_path(path):
+    """evidence/<...>/INCIDENTE_x.jpg -> evidence/<...>/INCIDENTE_x_thumb.jpg (al lado del original)."""
+    root, _ = os.path.splitext(path)
+    return f"{root}_thumb.jpg"
@@ -0,0 +1,95 @@
+# runner/migrations/0002_sync_model_state.py
+#
+# Pone al día el estado de migraciones con models.py (revisión docente, evidencia).
+# Esas columnas/tablas ya existen en las bases desplegadas, por eso el SQL usa
+# IF NOT EXISTS: en producción no hace nada y en una base nueva las crea.
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+SYNC_SQL = """
+ALTER TABLE runner_attempt ADD COLUMN IF NOT EXISTS review_status varchar(20) NOT NULL DEFAULT 'pending';
+ALTER TABLE runner_attempt ADD COLUMN IF NOT EXISTS teacher_comment text NULL;
+ALTER TABLE runner_attempt ADD COLUMN IF NOT EXISTS penalized_items jsonb NOT NULL DEFAULT '[]'::jsonb;
+ALTER TABLE runner_attempt ADD COLUMN IF NOT EXISTS penalty_points double precision NOT NULL DEFAULT 0;
+ALTER TABLE runner_attemptevent ALTER COLUMN evidence_url TYPE text;
+CREATE TABLE IF NOT EXISTS runner_evidence (
+    id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    file_url text NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    gemini_analysis jsonb NOT NULL,
+    attempt_id uuid NOT NULL REFERENCES runner_attempt (id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX IF NOT EXISTS runner_evidence_attempt_id_idx ON runner_evidence (attempt_id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(SYNC_SQL, reverse_sql=migrations.RunSQL.noop),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='attempt',
+                    name='review_status',
+                    field=models.CharField(choices=[('pending', 'Pendiente de Revisión'), ('approved', 'Aprobado / Validado'), ('rejected', 'Anulado (Fraude Detectado)'), ('revision', 'Requiere Ajuste Manual')], default='pending', max_length=20, verbose_name='Estado de Revisión'),
+                ),
+                migrations.AddField(
+                    model_name='attempt',
+                    name='teacher_comment',
+                    field=models.TextField(blank=True, help_text='Feedback del docente al alumno o justificación de anulación', null=True),
+                ),
+                migrations.AddField(
+                    model_name='attempt',
+                    name='penalized_items',
+                    field=models.JSONField(blank=True, default=list),
+                ),
+                migrations.AddField(
+                    model_name='attempt',
+                    name='penalty_points',
+                    field=models.FloatField(default=0.0, verbose_name='Puntos de Penalidad'),
+                ),
+                migrations.AlterField(
+                    model_name='attempt',
+                    name='photo_id_url',
+                    field=models.TextField(blank=True, null=True, verbose_name='Foto DNI (Path)'),
+                ),
+                migrations.AlterField(
+                    model_name='attempt',
+                    name='reference_face_url',
+                    field=models.TextField(blank=True, null=True, verbose_name='Foto Cara Ref (Path)'),
+                ),
+                migrations.AlterField(
+                    model_name='attemptevent',
+                    name='event_type',
+                    field=models.CharField(choices=[('SESSION_RESUME', 'Reconexión / Reanudación'), ('FOCUS_LOST', 'Pérdida de Foco (Cambio de Pestaña)'), ('FOCUS_GAINED', 'Retorno de Foco'), ('FULLSCREEN_EXIT', 'Salida de Pantalla Completa'), ('MULTI_FACE', 'Múltiples rostros detectados'), ('NO_FACE', 'Rostro no detectado'), ('AUDIO_SPIKE', 'Sonido/Voz detectada'), ('IDENTITY_MISMATCH', 'Suplantación de Identidad'), ('CAMERA_ERROR', 'Error de Cámara'), ('ANSWER_SAVED', 'Respuesta Guardada')], max_length=50),
+                ),
+                migrations.AlterField(
+                    model_name='attemptevent',
+                    name='evidence_url',
+                    field=models.TextField(blank=True, null=True),
+                ),
+                migrations.CreateModel(
+                    name='Evidence',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('file_url', models.TextField(help_text='Ruta del archivo')),
+                        ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                        ('gemini_analysis', models.JSONField(blank=True, default=dict, help_text='Respuesta cruda de la IA')),
+                        ('attempt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evidence_list', to='runner.attempt')),
+                    ],
+                    options={
+                        'ordering': ['timestamp'],
+                    },
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,95 @@
+# runner/migrations/0003_attempt_risk_counters.py
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, F, Value
+from django.db.models.functions import Coalesce
+
+RISK_COUNTERS = {
+    'FOCUS_LOST': ('focus_lost_count', 'risk_weight_focus_lost'),
+    'FULLSCREEN_EXIT': ('fullscreen_exit_count', 'risk_weight_fullscreen_exit'),
+    'NO_FACE': ('no_face_count', 'risk_weight_no_face'),
+    'MULTI_FACE': ('multi_face_count', 'risk_weight_multi_face'),
+    'IDENTITY_MISMATCH': ('identity_mismatch_count', 'risk_weight_identity_mismatch'),
+}
+BATCH_SIZE = 500
+
+
+def backfill_risk_counters(apps, schema_editor):
+    """
+    Calcula los contadores desde los eventos existentes, por lotes de intentos
+    para no bloquear toda la tabla en un solo UPDATE.
+    """
+    Attempt = apps.get_model('runner', 'Attempt')
+    AttemptEvent = apps.get_model('runner', 'AttemptEvent')
+    Tenant = apps.get_model('tenancy', 'Tenant')
+
+    def count_events(**filters):
+        events = AttemptEvent.objects.filter(attempt=OuterRef('pk'), **filters)
+        if filters.get('event_type') == 'IDENTITY_MISMATCH':
+            # Los fallos de validación de DNI no suman riesgo
+            events = events.exclude(metadata__reason__startswith='Fallo')
+        return Coalesce(Subquery(
+            events.order_by().values('attempt').annotate(n=Count('id')).values('n')[:1]
+        ), 0)
+
+    updates = {'event_count': count_events()}
+    for event_type, (counter_field, _) in RISK_COUNTERS.items():
+        updates[counter_field] = count_events(event_type=event_type)
+
+    risk_score = Value(0)
+    for counter_field, weight_field in RISK_COUNTERS.values():
+        risk_score = risk_score + F(counter_field) * Subquery(
+            Tenant.objects.filter(exams__attempts=OuterRef('pk')).values(weight_field)[:1]
+        )
+
+    attempt_ids = list(Attempt.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(attempt_ids), BATCH_SIZE):
+        batch = Attempt.objects.filter(pk__in=attempt_ids[start:start + BATCH_SIZE])
+        batch.update(**updates)
+        batch.update(risk_score=risk_score)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0002_sync_model_state'),
+        ('tenancy', '0002_tenant_risk_weights'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='event_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Eventos registrados'),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='focus_lost_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='fullscreen_exit_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='no_face_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='multi_face_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='identity_mismatch_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='risk_score',
+            field=models.IntegerField(db_index=True, default=0, verbose_name='Puntaje de Riesgo'),
+        ),
+        migrations.RunPython(backfill_risk_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# runner/migrations/0004_attempt_exam_version_permutation.py
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0003_attempt_risk_counters'),
+        ('exams', '0007_exam_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='exam_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='exams.examversion'),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='item_order',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='option_order',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# runner/migrations/0005_attempttimeline.py
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0004_attempt_exam_version_permutation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttemptTimeline',
+            fields=[
+                ('attempt', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='timeline', serialize=False, to='runner.attempt')),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('state', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# runner/migrations/0006_attemptevent_intervals.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0005_attempttimeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attemptevent',
+            name='ended_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attemptevent',
+            name='repeat_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
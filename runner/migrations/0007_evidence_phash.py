@@ -0,0 +1,22 @@
+# runner/migrations/0007_evidence_phash.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0006_attemptevent_intervals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidence',
+            name='phash',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='evidence',
+            name='duplicate_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Capturas duplicadas descartadas'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# runner/migrations/0008_evidence_thumbnail_url.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0007_evidence_phash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidence',
+            name='thumbnail_url',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
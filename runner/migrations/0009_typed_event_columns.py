@@ -0,0 +1,71 @@
+# runner/migrations/0009_typed_event_columns.py
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models, transaction
+from django.db.models import Max
+
+BATCH_SIZE = 5000
+
+
+def _id_ranges(model):
+    last_id = model.objects.aggregate(m=Max('id'))['m'] or 0
+    for start in range(0, last_id + 1, BATCH_SIZE):
+        yield start, start + BATCH_SIZE
+
+
+def backfill_typed_columns(apps, schema_editor):
+    """
+    Pasa los discriminadores de metadata/file_url a las columnas nuevas.
+    Por rangos de id, cada lote en su propia transacción, para no bloquear
+    las tablas durante todo el backfill.
+    """
+    AttemptEvent = apps.get_model('runner', 'AttemptEvent')
+    Evidence = apps.get_model('runner', 'Evidence')
+
+    for start, end in _id_ranges(AttemptEvent):
+        with transaction.atomic():
+            AttemptEvent.objects.filter(
+                id__gte=start, id__lt=end,
+                event_type='IDENTITY_MISMATCH', metadata__reason__startswith='Fallo',
+            ).update(subtype='DNI_VALIDATION', outcome='FAILED')
+
+    for start, end in _id_ranges(Evidence):
+        with transaction.atomic():
+            Evidence.objects.filter(
+                id__gte=start, id__lt=end, file_url__contains='INCIDENTE',
+            ).update(kind='INCIDENT')
+
+
+class Migration(migrations.Migration):
+    # Backfill por lotes e índices CONCURRENTLY: fuera de una transacción única
+    atomic = False
+
+    dependencies = [
+        ('runner', '0008_evidence_thumbnail_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attemptevent',
+            name='subtype',
+            field=models.CharField(blank=True, choices=[('', 'Monitoreo'), ('DNI_VALIDATION', 'Validación de DNI')], default='', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='attemptevent',
+            name='outcome',
+            field=models.CharField(blank=True, choices=[('', 'Sin resultado'), ('FAILED', 'Fallido')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='evidence',
+            name='kind',
+            field=models.CharField(choices=[('DNI', 'Documento (DNI)'), ('FACE_REF', 'Rostro de referencia'), ('INCIDENT', 'Incidente')], default='DNI', max_length=10),
+        ),
+        migrations.RunPython(backfill_typed_columns, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='attemptevent',
+            index=models.Index(fields=['attempt', 'event_type', 'timestamp'], name='runner_event_att_type_ts'),
+        ),
+        AddIndexConcurrently(
+            model_name='evidence',
+            index=models.Index(fields=['attempt', 'kind', 'timestamp'], name='runner_evid_att_kind_ts'),
+        ),
+    ]
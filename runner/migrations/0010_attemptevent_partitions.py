@@ -0,0 +1,90 @@
+# runner/migrations/0010_attemptevent_partitions.py
+from datetime import date
+
+from django.db import migrations, models
+
+TABLE = 'runner_attemptevent'
+FK_NAME = 'runner_attemptevent_attempt_id_3f7fd1af_fk_runner_attempt_id'
+FK_INDEX = 'runner_attemptevent_attempt_id_3f7fd1af'
+MONTHS_AHEAD = 2
+
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_indexes(cursor, primary_key):
+    cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ({primary_key})')
+    cursor.execute(
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {FK_NAME} FOREIGN KEY (attempt_id) '
+        f'REFERENCES runner_attempt (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+    cursor.execute(f'CREATE INDEX {FK_INDEX} ON {TABLE} (attempt_id)')
+    cursor.execute(f'CREATE INDEX runner_event_att_type_ts ON {TABLE} (attempt_id, event_type, "timestamp")')
+
+
+def _copy_rows(cursor, source):
+    cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {source}')
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)"
+    )
+    cursor.execute(f'DROP TABLE {source}')
+
+
+def partition_events(apps, schema_editor):
+    """
+    Rehace runner_attemptevent como tabla particionada por mes (timestamp).
+    La PK pasa a ser (id, timestamp): Postgres exige la clave de partición en
+    ella. Se crea una partición por mes desde el evento más viejo hasta
+    MONTHS_AHEAD meses adelante, más una default de resguardo.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {TABLE}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+
+        cursor.execute(f"SELECT MIN(timestamp AT TIME ZONE 'UTC')::date, (now() AT TIME ZONE 'UTC')::date FROM {TABLE}_old")
+        oldest, today = cursor.fetchone()
+        month = date((oldest or today).year, (oldest or today).month, 1)
+        last = _add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+        while month <= last:
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [f'{month.isoformat()}T00:00:00+00:00', f'{_add_months(month, 1).isoformat()}T00:00:00+00:00']
+            )
+            month = _add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {TABLE}_pdefault PARTITION OF {TABLE} DEFAULT')
+
+        _copy_rows(cursor, f'{TABLE}_old')
+        _create_indexes(cursor, 'id, "timestamp"')
+
+
+def unpartition_events(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_partitioned')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {TABLE}_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY)'
+        )
+        _copy_rows(cursor, f'{TABLE}_partitioned')
+        _create_indexes(cursor, 'id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0009_typed_event_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='events_archive_path',
+            field=models.TextField(blank=True, null=True, verbose_name='Eventos archivados (Path)'),
+        ),
+        migrations.RunPython(partition_events, unpartition_events),
+    ]
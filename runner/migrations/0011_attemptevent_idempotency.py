@@ -0,0 +1,27 @@
+# runner/migrations/0011_attemptevent_idempotency.py
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0010_attemptevent_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attemptevent',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='attemptevent',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name='attemptevent',
+            constraint=models.UniqueConstraint(fields=('idempotency_key', 'timestamp'), name='runner_event_idempotency'),
+        ),
+    ]
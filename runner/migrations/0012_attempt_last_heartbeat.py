@@ -0,0 +1,17 @@
+# runner/migrations/0012_attempt_last_heartbeat.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runner', '0011_attemptevent_idempotency'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attempt',
+            name='last_heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
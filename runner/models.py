@@ -1,9 +1,97 @@
 import uuid
+from collections import Counter, defaultdict
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Value
 from django.conf import settings
 from django.utils import timezone
-from django.core.files.storage import default_storage # <--- Necesario para firmar links
-from exams.models import Exam
+from exams.models import Exam, ExamVersion
+from exams.compiled import get_compiled_exam, get_version_payload, build_permutation, ordered_items
+from tenancy.models import Tenant
+from .storage import signed_url
+
+# --- CONTADORES DE RIESGO ---
+# Tipo de evento -> (contador en Attempt, peso en Tenant)
+RISK_COUNTERS = {
+    'FOCUS_LOST': ('focus_lost_count', 'risk_weight_focus_lost'),
+    'FULLSCREEN_EXIT': ('fullscreen_exit_count', 'risk_weight_fullscreen_exit'),
+    'NO_FACE': ('no_face_count', 'risk_weight_no_face'),
+    'MULTI_FACE': ('multi_face_count', 'risk_weight_multi_face'),
+    'IDENTITY_MISMATCH': ('identity_mismatch_count', 'risk_weight_identity_mismatch'),
+}
+
+
+# Subtipos/resultados tipados de AttemptEvent (antes se leían de metadata['reason'])
+EVENT_SUBTYPE_DNI_VALIDATION = 'DNI_VALIDATION'
+EVENT_OUTCOME_FAILED = 'FAILED'
+
+
+def classify_event(event_type, metadata):
+    """
+    (subtype, outcome) de un evento a partir de su tipo y metadata.
+    Los IDENTITY_MISMATCH que genera la validación de DNI ('Fallo (n): ...')
+    son reintentos fallidos del alumno, no suplantación.
+    """
+    if event_type == 'IDENTITY_MISMATCH' and str((metadata or {}).get('reason', '')).startswith('Fallo'):
+        return EVENT_SUBTYPE_DNI_VALIDATION, EVENT_OUTCOME_FAILED
+    return '', ''
+
+
+def counts_for_risk(event):
+    """Los reintentos de la validación de DNI no suman riesgo."""
+    return event.event_type in RISK_COUNTERS and event.subtype != EVENT_SUBTYPE_DNI_VALIDATION
+
+
+def apply_risk_counters(events):
+    """
+    Suma los eventos recién insertados a los contadores del intento.
+    Un UPDATE por intento con expresiones F (sin leer la fila): el delta de
+    risk_score se calcula en la base con los pesos del tenant.
+    """
+    totals = Counter()
+    per_type = defaultdict(Counter)
+    for event in events:
+        totals[event.attempt_id] += 1
+        if counts_for_risk(event):
+            per_type[event.attempt_id][event.event_type] += 1
+
+    for attempt_id, total in totals.items():
+        _increment_counters(attempt_id, total, per_type[attempt_id])
+
+
+def add_risk_units(attempt_id, event_type, units):
+    """Unidades extra de riesgo por duración de un intervalo (ver runner.events.ingest_events)."""
+    if units > 0 and event_type in RISK_COUNTERS:
+        _increment_counters(attempt_id, 0, Counter({event_type: units}))
+
+
+def _increment_counters(attempt_id, total, per_type):
+    updates = {'event_count': F('event_count') + total}
+    risk_delta = Value(0)
+    for event_type, n in per_type.items():
+        counter_field, weight_field = RISK_COUNTERS[event_type]
+        updates[counter_field] = F(counter_field) + n
+        risk_delta = risk_delta + F(weight_field) * n
+
+    if per_type:
+        weighted = Tenant.objects.filter(exams__attempts=OuterRef('pk')).annotate(
+            risk_delta=risk_delta
+        ).values('risk_delta')[:1]
+        updates['risk_score'] = F('risk_score') + Subquery(weighted)
+
+    Attempt.objects.filter(id=attempt_id).update(**updates)
+
+
+def recompute_risk_scores(attempts):
+    """
+    Recalcula risk_score desde los contadores (ej. cuando cambian los pesos del tenant).
+    Un solo UPDATE set-based sobre el queryset recibido.
+    """
+    weighted = Value(0)
+    for counter_field, weight_field in RISK_COUNTERS.values():
+        weighted = weighted + F(counter_field) * Subquery(
+            Tenant.objects.filter(exams__attempts=OuterRef('pk')).values(weight_field)[:1]
+        )
+    return attempts.update(risk_score=weighted)
 
 class Attempt(models.Model):
     """
@@ -30,9 +118,15 @@ class Attempt(models.Model):
     end_time = models.DateTimeField(null=True, blank=True, verbose_name="Fin")
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name="Completado el")
     
-    last_heartbeat = models.DateTimeField(auto_now=True)
+    # Lo escribe runner.heartbeat en lotes (no auto_now: guardar el intento no es señal de vida)
+    last_heartbeat = models.DateTimeField(null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
+    # Versión del examen que rinde y su permutación (índices contra el payload de la versión)
+    exam_version = models.ForeignKey(ExamVersion, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    item_order = models.JSONField(default=list, blank=True)
+    option_order = models.JSONField(default=list, blank=True)
+
     # Respuestas y Calificación
     answers = models.JSONField(default=dict, blank=True)
     score = models.FloatField(null=True, blank=True)
@@ -64,23 +158,47 @@ class Attempt(models.Model):
     # NUEVO: Puntos a restar manualmente de la nota final
     penalty_points = models.FloatField(default=0.0, verbose_name="Puntos de Penalidad")
 
+    # --- CONTADORES DE RIESGO (Denormalizados, se mantienen al insertar eventos) ---
+    event_count = models.PositiveIntegerField(default=0, verbose_name="Eventos registrados")
+    focus_lost_count = models.PositiveIntegerField(default=0)
+    fullscreen_exit_count = models.PositiveIntegerField(default=0)
+    no_face_count = models.PositiveIntegerField(default=0)
+    multi_face_count = models.PositiveIntegerField(default=0)
+    identity_mismatch_count = models.PositiveIntegerField(default=0)
+    risk_score = models.IntegerField(default=0, db_index=True, verbose_name="Puntaje de Riesgo")
+
+    # Eventos exportados a JSONL comprimido (ver runner.archive); su partición puede ya no existir
+    events_archive_path = models.TextField(null=True, blank=True, verbose_name="Eventos archivados (Path)")
+
     # --- SOLUCIÓN ERROR XML: Generador de Links Dinámicos ---
     @property
     def signed_photo_id_url(self):
-        if self.photo_id_url:
-            # Si es un link viejo (http), lo devolvemos tal cual. Si es path, lo firmamos.
-            if self.photo_id_url.startswith('http'): return self.photo_id_url
-            try: return default_storage.url(self.photo_id_url)
-            except: return ""
-        return None
+        # Links viejos (http) se devuelven tal cual; los paths se firman (con cache)
+        return signed_url(self.photo_id_url)
 
     @property
     def signed_face_url(self):
-        if self.reference_face_url:
-            if self.reference_face_url.startswith('http'): return self.reference_face_url
-            try: return default_storage.url(self.reference_face_url)
-            except: return ""
-        return None
+        return signed_url(self.reference_face_url)
+
+    def pin_exam_version(self, exam=None):
+        """Fija la versión compilada vigente y calcula el orden de ítems/opciones (no guarda)."""
+        exam = exam or self.exam
+        payload = get_compiled_exam(exam)
+        self.exam_version_id = exam.compiled_version_id
+        self.item_order, self.option_order = build_permutation(payload, str(self.id))
+        return payload
+
+    def get_exam_payload(self):
+        """Payload de la versión que rinde el intento (cacheado); fija una si es un intento viejo."""
+        if not self.exam_version_id:
+            self.pin_exam_version()
+            Attempt.objects.filter(id=self.id, exam_version__isnull=True).update(
+                exam_version_id=self.exam_version_id, item_order=self.item_order, option_order=self.option_order
+            )
+        return get_version_payload(self.exam_version_id)
+
+    def get_ordered_items(self):
+        return ordered_items(self.get_exam_payload(), self.item_order, self.option_order)
 
     class Meta:
         ordering = ['-start_time']
@@ -91,16 +209,33 @@ class Attempt(models.Model):
         return f"{self.student_name} ({self.student_legajo}) - {self.exam.title}"
 
 
+class AttemptEventQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            obj.classify()
+        objs = super().bulk_create(objs, *args, **kwargs)
+        apply_risk_counters(objs)
+        return objs
+
+
 class AttemptEvent(models.Model):
     """
     Bitácora de seguridad (Caja Negra).
+    En la base está particionada por mes (ver runner.partitions); leer con
+    runner.archive.attempt_events para incluir los intentos ya archivados.
     """
+    objects = AttemptEventQuerySet.as_manager()
+
     attempt = models.ForeignKey(Attempt, on_delete=models.CASCADE, related_name='events')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Momento del request (no del INSERT): con ingesta por stream la escritura llega después
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Reintentos y reentregas del stream no duplican filas (ver runner.events)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
     
     EVENT_TYPES = [
         ('SESSION_RESUME', 'Reconexión / Reanudación'),
         ('FOCUS_LOST', 'Pérdida de Foco (Cambio de Pestaña)'),
+        ('FOCUS_GAINED', 'Retorno de Foco'),
         ('FULLSCREEN_EXIT', 'Salida de Pantalla Completa'),
         ('MULTI_FACE', 'Múltiples rostros detectados'),
         ('NO_FACE', 'Rostro no detectado'),
@@ -111,43 +246,103 @@ class AttemptEvent(models.Model):
     ]
     event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
     metadata = models.JSONField(default=dict, blank=True)
+    # Discriminadores tipados (ver classify_event): se filtran sin leer el JSON
+    SUBTYPES = [
+        ('', 'Monitoreo'),
+        (EVENT_SUBTYPE_DNI_VALIDATION, 'Validación de DNI'),
+    ]
+    OUTCOMES = [
+        ('', 'Sin resultado'),
+        (EVENT_OUTCOME_FAILED, 'Fallido'),
+    ]
+    subtype = models.CharField(max_length=30, choices=SUBTYPES, default='', blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOMES, default='', blank=True)
+    # Intervalo: repeticiones consecutivas del mismo incidente se fusionan en una fila
+    ended_at = models.DateTimeField(null=True, blank=True)
+    repeat_count = models.PositiveIntegerField(default=1)
     evidence_url = models.TextField(null=True, blank=True) # Guardamos PATH
 
+    def classify(self):
+        if not self.subtype:
+            self.subtype, self.outcome = classify_event(self.event_type, self.metadata)
+
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        if is_new:
+            self.classify()
+        super().save(*args, **kwargs)
+        if is_new:
+            apply_risk_counters([self])
+
     @property
     def signed_evidence_url(self):
-        path = self.evidence_url or self.metadata.get('evidence_url')
-        if path:
-            if path.startswith('http'): return path
-            try: return default_storage.url(path)
-            except: return ""
-        return None
+        return signed_url(self.evidence_url or self.metadata.get('evidence_url'))
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['attempt', 'event_type', 'timestamp'], name='runner_event_att_type_ts'),
+        ]
+        constraints = [
+            # En la tabla particionada toda clave única debe incluir timestamp
+            models.UniqueConstraint(fields=['idempotency_key', 'timestamp'], name='runner_event_idempotency'),
+        ]
 
     def __str__(self):
         return f"{self.get_event_type_display()} - {self.timestamp.strftime('%H:%M:%S')}"
 
 
+class AttemptTimeline(models.Model):
+    """
+    Resultado guardado del análisis de incidentes (ver runner.timeline).
+    El detalle del intento lo lee en lugar de recorrer todos los eventos.
+    """
+    attempt = models.OneToOneField(Attempt, on_delete=models.CASCADE, primary_key=True, related_name='timeline')
+    # Cursor incremental: último evento procesado
+    last_event_id = models.BigIntegerField(default=0)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    # Inicio del intento usado en el análisis (si cambia, se recalcula)
+    start_time = models.DateTimeField(null=True, blank=True)
+    state = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Timeline {self.attempt_id}"
+
+
 class Evidence(models.Model):
     """
     Almacena fotos individuales de validación o monitoreo.
     """
     attempt = models.ForeignKey(Attempt, on_delete=models.CASCADE, related_name='evidence_list')
     file_url = models.TextField(help_text="Ruta del archivo") # Guardamos PATH
+    KIND_DNI = 'DNI'
+    KIND_FACE_REF = 'FACE_REF'
+    KIND_INCIDENT = 'INCIDENT'
+    KINDS = [
+        (KIND_DNI, 'Documento (DNI)'),
+        (KIND_FACE_REF, 'Rostro de referencia'),
+        (KIND_INCIDENT, 'Incidente'),
+    ]
+    # Antes se deducía con file_url__contains='INCIDENTE'
+    kind = models.CharField(max_length=10, choices=KINDS, default=KIND_DNI)
     timestamp = models.DateTimeField(default=timezone.now)
     gemini_analysis = models.JSONField(default=dict, blank=True, help_text="Respuesta cruda de la IA")
+    # Hash perceptual (dHash, 64 bits en hex) para descartar capturas casi idénticas
+    phash = models.CharField(max_length=16, null=True, blank=True)
+    duplicate_count = models.PositiveIntegerField(default=0, verbose_name="Capturas duplicadas descartadas")
+    # Miniatura liviana guardada al lado del original (PATH)
+    thumbnail_url = models.TextField(null=True, blank=True)
 
     @property
     def signed_file_url(self):
-        if self.file_url:
-            if self.file_url.startswith('http'): return self.file_url
-            try: return default_storage.url(self.file_url)
-            except: return ""
-        return None
+        return signed_url(self.file_url)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['attempt', 'kind', 'timestamp'], name='runner_evid_att_kind_ts'),
+        ]
 
     def __str__(self):
         return f"Evidencia {self.id} - {self.attempt}"
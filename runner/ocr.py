@@ -0,0 +1,65 @@
+"""
+OCR local para el DNI (backend configurable con DNI_OCR_BACKEND).
+
+Corre en la cola 'ocr' (worker propio con concurrencia acotada, ver render.yaml):
+el modelo se carga una sola vez por proceso del worker y se reutiliza. Gemini
+queda como respaldo cuando el OCR local no encuentra el número (runner.tasks.verify_dni).
+Los números leídos se cachean por contenido de la imagen (runner.verdicts).
+"""
+import logging
+import re
+
+from django.conf import settings
+
+from .verdicts import get_verdict, image_digest, store_verdict
+
+logger = logging.getLogger(__name__)
+
+# Subirla al cambiar el backend o el parseo: invalida los veredictos cacheados
+OCR_VERSION = 1
+
+# Números de documento: 7-8 dígitos, con o sin puntos (12.345.678)
+DOCUMENT_NUMBER_RE = re.compile(r'\d{1,2}\.?\d{3}\.?\d{3}')
+
+_easyocr_reader = None
+
+
+def _easyocr_text(image_bytes):
+    global _easyocr_reader
+    if _easyocr_reader is None:
+        import easyocr  # Pesado (torch): solo lo importa el worker de OCR
+        _easyocr_reader = easyocr.Reader(['es'], gpu=False, verbose=False,
+                                         model_storage_directory=settings.EASYOCR_MODEL_DIR)
+    return ' '.join(_easyocr_reader.readtext(image_bytes, detail=0, allowlist='0123456789.'))
+
+
+# nombre -> función(bytes de la imagen) -> texto. DNI_OCR_BACKEND='' desactiva el OCR local
+OCR_BACKENDS = {
+    'easyocr': _easyocr_text,
+}
+
+
+def extract_document_numbers(image_bytes):
+    """
+    Números de documento leídos en la imagen ([] si no hay ninguno), o None si
+    no hay backend local disponible (no configurado o sin la librería instalada).
+    """
+    backend = OCR_BACKENDS.get(settings.DNI_OCR_BACKEND)
+    if backend is None:
+        return None
+    verdict_backend = f"ocr:{settings.DNI_OCR_BACKEND}:v{OCR_VERSION}"
+    digest = image_digest(image_bytes)
+    cached = get_verdict(verdict_backend, digest)
+    if cached is not None:
+        return cached
+    try:
+        text = backend(image_bytes)
+    except ImportError as e:
+        logger.warning("OCR local '%s' no disponible: %s", settings.DNI_OCR_BACKEND, e)
+        return None
+    except Exception as e:
+        logger.error("Error de OCR local: %s", e)
+        return []
+    numbers = [match.replace('.', '') for match in DOCUMENT_NUMBER_RE.findall(text)]
+    store_verdict(verdict_backend, digest, numbers)
+    return numbers
@@ -0,0 +1,95 @@
+"""
+Particiones mensuales de runner_attemptevent (PARTITION BY RANGE timestamp).
+
+Django no sabe nada de esto: la tabla padre se llama igual y el ORM la usa
+como siempre. Acá solo se crean las particiones por adelantado y se borran
+las viejas una vez archivadas (ver runner.archive).
+"""
+import logging
+import re
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EVENT_TABLE = 'runner_attemptevent'
+DEFAULT_PARTITION = f'{EVENT_TABLE}_pdefault'
+PARTITION_RE = re.compile(rf'^{EVENT_TABLE}_p(\d{{4}})(\d{{2}})$')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{EVENT_TABLE}_p{month:%Y%m}'
+
+
+def _bound(month):
+    return datetime.combine(month, time.min, tzinfo=dt_timezone.utc).isoformat()
+
+
+def create_event_partition(month):
+    """Crea la partición del mes (idempotente). False si no se pudo (p. ej. filas del mes en la default)."""
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {EVENT_TABLE} '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [_bound(month), _bound(add_months(month, 1))]
+            )
+        return True
+    except Exception as e:
+        logger.error("No se pudo crear la partición %s: %s", partition_name(month), e)
+        return False
+
+
+def ensure_event_partitions(months_ahead=2):
+    """Mes actual y los próximos: los inserts nunca deberían caer en la partición default."""
+    current = month_start(timezone.now())
+    for n in range(months_ahead + 1):
+        create_event_partition(add_months(current, n))
+
+
+def list_event_partitions():
+    """[(nombre, mes)] de las particiones mensuales existentes, de la más vieja a la más nueva."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass", [EVENT_TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def partition_attempt_ids(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT DISTINCT attempt_id FROM {name}')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def drop_event_partition(name):
+    """DETACH + DROP: libera el espacio de una vez, sin DELETE masivo ni VACUUM."""
+    if not PARTITION_RE.match(name):
+        raise ValueError(f"No es una partición mensual de eventos: {name}")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {EVENT_TABLE} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+
+
+def default_partition_rows():
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM {DEFAULT_PARTITION}')
+        return cursor.fetchone()[0]
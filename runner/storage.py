@@ -0,0 +1,144 @@
+"""
+Helpers de storage para la evidencia de proctoring.
+Las claves de un intento viven bajo evidence/<attempt_id>/ para poder
+emitir URLs pre-firmadas acotadas a ese prefijo.
+"""
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evidencia que el navegador puede subir directo al bucket
+EVIDENCE_UPLOAD_KINDS = ('INCIDENTE', 'FACE_REF', 'DNI_REF')
+
+
+def evidence_prefix(attempt_id):
+    return f"evidence/{attempt_id}/"
+
+
+def new_evidence_path(attempt_id, kind):
+    return f"{evidence_prefix(attempt_id)}{kind}_{uuid.uuid4().hex[:8]}.jpg"
+
+
+def is_attempt_evidence_path(attempt_id, path):
+    """
+    Valida que un path informado por el cliente pertenezca al intento
+    (evita que un alumno referencie archivos de otro intento).
+    """
+    if not path or not isinstance(path, str):
+        return False
+    if '..' in path or path.startswith('/'):
+        return False
+    return path.startswith(evidence_prefix(attempt_id))
+
+
+def is_uploaded_evidence(attempt_id, path):
+    """
+    Confirmación de una subida directa: el path es del intento y el objeto
+    realmente existe en el bucket (el PUT pre-firmado pudo haber fallado).
+    """
+    if not is_attempt_evidence_path(attempt_id, path):
+        return False
+    try:
+        return default_storage.exists(path)
+    except Exception as e:
+        logger.warning("No se pudo verificar la subida %s: %s", path, e)
+        return False
+
+
+def presigned_upload(path, content_type='image/jpeg'):
+    """
+    Genera una URL PUT pre-firmada de vida corta para `path`.
+    Devuelve None si el storage no es S3-compatible (ej. FileSystemStorage local):
+    en ese caso el runner sigue mandando la imagen en base64.
+    """
+    connection = getattr(default_storage, 'connection', None)
+    bucket_name = getattr(default_storage, 'bucket_name', None)
+    if connection is None or not bucket_name:
+        return None
+
+    from storages.utils import clean_name
+    key = default_storage._normalize_name(clean_name(path))
+    expires = getattr(settings, 'EVIDENCE_UPLOAD_URL_EXPIRES', 120)
+
+    url = connection.meta.client.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': bucket_name, 'Key': key, 'ContentType': content_type},
+        ExpiresIn=expires,
+        HttpMethod='PUT',
+    )
+    return {
+        'url': url,
+        'method': 'PUT',
+        'headers': {'Content-Type': content_type},
+        'expires_in': expires,
+    }
+
+
+# --- URLS FIRMADAS PARA LECTURA (cacheadas) ---
+# Con S3Storage cada default_storage.url() es una firma SigV4. Cacheamos la URL
+# por path durante el 80% de su vida, y las listas se resuelven con un solo
+# get_many/set_many contra el cache.
+SIGNED_URL_CACHE_FRACTION = 0.8
+
+
+def _signed_url_ttl():
+    expire = getattr(default_storage, 'querystring_expire', None) or 3600
+    return max(1, int(expire * SIGNED_URL_CACHE_FRACTION))
+
+
+def _signed_url_key(path):
+    return "signed_url:" + hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+
+def _sign(path):
+    try:
+        return default_storage.url(path)
+    except Exception as e:
+        logger.warning("Error generando URL firmada para %s: %s", path, e)
+        return None
+
+
+def signed_urls(paths):
+    """
+    {path: url} para una lista de paths. Los links viejos (http...) se devuelven
+    tal cual; los vacíos se ignoran. Solo se firman los que no están en cache.
+    """
+    result = {}
+    pending = set()
+    for path in paths:
+        if not path:
+            continue
+        path = str(path)
+        if path.startswith('http'):
+            result[path] = path
+        else:
+            pending.add(path)
+    if not pending:
+        return result
+
+    keys = {_signed_url_key(path): path for path in pending}
+    cached = cache.get_many(keys.keys())
+    fresh = {}
+    for key, path in keys.items():
+        url = cached.get(key)
+        if url is None:
+            url = _sign(path)
+            if url:
+                fresh[key] = url
+        result[path] = url
+    if fresh:
+        cache.set_many(fresh, _signed_url_ttl())
+    return result
+
+
+def signed_url(path):
+    """URL firmada (cacheada) de un path de evidencia; None si no hay path."""
+    if not path:
+        return None
+    return signed_urls([path]).get(str(path))
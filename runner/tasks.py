@@ -0,0 +1,319 @@
+import base64
+import logging
+import time
+
+from celery import shared_task
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from exams.answer_key import build_answer_key, grade
+from plataforma import gemini
+from .models import Attempt, AttemptEvent, Evidence, EVENT_SUBTYPE_DNI_VALIDATION, EVENT_OUTCOME_FAILED
+from .timeline import refresh_timeline
+from .dedup import dedupe_evidence, replace_evidence_reference
+from .imaging import normalize_image, thumbnail_path
+from .archive import archive_old_partitions
+from .events import stream_enabled, drain_event_stream
+from .heartbeat import flush_heartbeats as flush_pending_heartbeats
+from .dni import DNI_RATE_LIMIT_COUNTDOWN, DNI_RATE_LIMIT_RETRIES, MAX_DNI_ATTEMPTS, check_dni, legajo_matches
+from .ocr import extract_document_numbers
+
+logger = logging.getLogger(__name__)
+
+REGRADE_CHUNK_SIZE = 500
+
+
+# --- SUBIDA DIFERIDA DE EVIDENCIA ---
+# Las vistas del runner solo "estacionan" la imagen (base64) y encolan esta tarea.
+# El decode y el PUT a R2 corren en el worker, no en los 4 workers de gunicorn.
+@shared_task(bind=True, max_retries=3, default_retry_delay=5)
+def store_evidence_image(self, image_b64, filename, attempt_id=None, attempt_field=None,
+                         evidence_id=None, event_id=None, dedupe=False):
+    """
+    Sube la imagen al storage y completa las referencias pendientes:
+    - Attempt.<attempt_field> (photo_id_url / reference_face_url)
+    - Evidence.file_url (+ thumbnail_url)
+    - AttemptEvent.metadata['evidence_path']
+    Las vistas ya guardaron `filename` como path provisorio; solo reescribimos
+    si el storage eligió otro nombre (colisión).
+    Con dedupe=True (capturas de incidentes), una imagen casi idéntica a otra
+    reciente del intento no se sube: se reutiliza la existente.
+    """
+    try:
+        # b64decode descarta los caracteres inválidos: vacío también es ilegible
+        image_content = base64.b64decode(image_b64)
+        if not image_content:
+            raise ValueError("Imagen vacía")
+    except Exception:
+        _discard_pending_upload(filename, attempt_id, attempt_field, evidence_id)
+        return None
+
+    phash = None
+    if dedupe and evidence_id:
+        duplicate_of, phash = dedupe_evidence(evidence_id, image_content)
+        if duplicate_of:
+            return duplicate_of
+
+    image_content, thumbnail = _normalize(image_content)
+
+    try:
+        saved_path = default_storage.save(filename, ContentFile(image_content))
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+    if evidence_id:
+        updates = {}
+        if saved_path != filename:
+            updates['file_url'] = saved_path
+        if thumbnail:
+            updates['thumbnail_url'] = _store_thumbnail(saved_path, thumbnail)
+        if phash:
+            # Recién ahora (archivo subido) puede servir de original para deduplicar
+            updates['phash'] = phash
+        if updates:
+            Evidence.objects.filter(id=evidence_id).update(**updates)
+
+    if saved_path == filename:
+        return saved_path
+
+    if attempt_id and attempt_field in ('photo_id_url', 'reference_face_url'):
+        Attempt.objects.filter(id=attempt_id, **{attempt_field: filename}).update(**{attempt_field: saved_path})
+
+    if event_id:
+        event = AttemptEvent.objects.filter(id=event_id).first()
+        if event:
+            event.metadata['evidence_path'] = saved_path
+            event.save(update_fields=['metadata'])
+    elif evidence_id:
+        # Modo stream: el evento todavía no tiene fila (se resuelve al drenar)
+        evidence_attempt_id = Evidence.objects.filter(id=evidence_id).values_list('attempt_id', flat=True).first()
+        if evidence_attempt_id:
+            replace_evidence_reference(evidence_attempt_id, filename, saved_path)
+
+    return saved_path
+
+
+def _discard_pending_upload(filename, attempt_id, attempt_field, evidence_id):
+    """
+    La imagen no se pudo decodificar y nunca llegará al storage: las referencias
+    provisorias no pueden quedar apuntando a `filename`.
+    """
+    if attempt_id and attempt_field in ('photo_id_url', 'reference_face_url'):
+        Attempt.objects.filter(id=attempt_id, **{attempt_field: filename}).update(**{attempt_field: None})
+    evidence = Evidence.objects.filter(id=evidence_id).first() if evidence_id else None
+    if evidence is None:
+        return
+    if evidence.kind == Evidence.KIND_DNI:
+        # El intento de DNI se conserva (lo cuenta el gate y lo resuelve verify_dni), sin archivo
+        Evidence.objects.filter(id=evidence_id).update(file_url='')
+    else:
+        evidence.delete()
+        replace_evidence_reference(evidence.attempt_id, filename, None)
+
+
+def _normalize(image_content):
+    """(imagen normalizada, miniatura); si Pillow no puede leerla se guarda tal cual, sin miniatura."""
+    try:
+        return normalize_image(image_content)
+    except Exception:
+        return image_content, None
+
+
+def _store_thumbnail(path, thumbnail):
+    try:
+        return default_storage.save(thumbnail_path(path), ContentFile(thumbnail))
+    except Exception:
+        # Sin miniatura la revisión muestra el original
+        return None
+
+
+# Capturas subidas directo al bucket (URL pre-firmada): se procesan después
+@shared_task(bind=True, max_retries=3, default_retry_delay=5)
+def process_uploaded_evidence(self, evidence_id):
+    """Deduplica, normaliza (reescribe el objeto si cambió) y genera la miniatura."""
+    evidence = Evidence.objects.filter(id=evidence_id).only('id', 'attempt_id', 'file_url').first()
+    if not evidence:
+        return None
+    try:
+        with default_storage.open(evidence.file_url, 'rb') as f:
+            image_content = f.read()
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+    duplicate_of, phash = dedupe_evidence(evidence_id, image_content)
+    if duplicate_of:
+        default_storage.delete(evidence.file_url)
+        return duplicate_of
+
+    normalized, thumbnail = _normalize(image_content)
+    if normalized is not image_content:
+        # Primero la versión normalizada (el storage no sobreescribe: elige otra clave);
+        # el original se borra solo cuando la nueva copia ya existe y está referenciada
+        try:
+            saved_path = default_storage.save(evidence.file_url, ContentFile(normalized))
+        except Exception as exc:
+            raise self.retry(exc=exc)
+        if saved_path != evidence.file_url:
+            Evidence.objects.filter(id=evidence_id).update(file_url=saved_path)
+            replace_evidence_reference(evidence.attempt_id, evidence.file_url, saved_path)
+            try:
+                default_storage.delete(evidence.file_url)
+            except Exception as e:
+                logger.warning("No se pudo borrar el original %s: %s", evidence.file_url, e)
+            evidence.file_url = saved_path
+    updates = {'phash': phash} if phash else {}
+    if thumbnail:
+        updates['thumbnail_url'] = _store_thumbnail(evidence.file_url, thumbnail)
+    if updates:
+        Evidence.objects.filter(id=evidence_id).update(**updates)
+    return evidence.file_url
+
+
+# --- RECORRECCIÓN MASIVA ---
+# Tras cambiar puntajes o la respuesta correcta, recalcula Attempt.score de todo
+# el examen en bloques (una lectura + un bulk_update por bloque).
+@shared_task(bind=True)
+def regrade_exam(self, exam_id, chunk_size=REGRADE_CHUNK_SIZE):
+    """
+    Recalcula la nota de los intentos ya corregidos del examen.
+    Los anulados (rejected) conservan su 0; penalized_items y penalty_points
+    se respetan igual que en la corrección individual.
+    Informa el avance en el resultado de la tarea (state PROGRESS).
+    """
+    # Clave fresca desde la base: no dependemos de la versión cacheada
+    answer_key = build_answer_key(exam_id)
+
+    attempts = Attempt.objects.filter(exam_id=exam_id, score__isnull=False)\
+                              .exclude(review_status='rejected')\
+                              .only('id', 'answers', 'penalized_items', 'penalty_points', 'score')\
+                              .order_by('id')
+    total = attempts.count()
+    done = updated = 0
+    last_id = None
+
+    while True:
+        chunk = attempts.filter(id__gt=last_id) if last_id else attempts
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+
+        changed = []
+        for attempt in chunk:
+            new_score = grade(answer_key, attempt.answers, attempt.penalized_items, attempt.penalty_points)
+            if attempt.score != new_score:
+                attempt.score = new_score
+                changed.append(attempt)
+        if changed:
+            Attempt.objects.bulk_update(changed, ['score'])
+
+        done += len(chunk)
+        updated += len(changed)
+        last_id = chunk[-1].id
+        self.update_state(state='PROGRESS', meta={'done': done, 'total': total, 'updated': updated})
+
+    return {'done': done, 'total': total, 'updated': updated}
+
+
+# --- LÍNEA DE TIEMPO DE INCIDENTES ---
+@shared_task
+def analyze_attempt_timeline(attempt_id):
+    attempt = Attempt.objects.filter(id=attempt_id).first()
+    if attempt:
+        refresh_timeline(attempt)
+
+
+# --- ARCHIVO DE EVENTOS (Celery beat, ver CELERY_BEAT_SCHEDULE) ---
+@shared_task
+def archive_event_partitions():
+    """Crea las particiones de los próximos meses y archiva/borra las vencidas."""
+    return archive_old_partitions()
+
+
+# --- CONSUMIDOR DEL STREAM DE EVENTOS (cola 'events', ver runner.events) ---
+STREAM_FLUSH_SECONDS = 25
+
+@shared_task
+def flush_event_stream():
+    """Drena el stream durante ~STREAM_FLUSH_SECONDS; beat lo relanza cada 30 s."""
+    if not stream_enabled():
+        return 0
+    processed = 0
+    deadline = time.monotonic() + STREAM_FLUSH_SECONDS
+    while time.monotonic() < deadline:
+        processed += drain_event_stream()
+    return processed
+
+
+# --- HEARTBEATS (Redis -> base, en lote) ---
+@shared_task
+def flush_heartbeats():
+    return flush_pending_heartbeats()
+
+
+# --- VERIFICACIÓN DE DNI (cola 'ocr', ver runner.ocr y runner.dni) ---
+@shared_task(bind=True, max_retries=DNI_RATE_LIMIT_RETRIES)
+def verify_dni(self, evidence_id, base64_clean):
+    """
+    Verifica la foto del DNI y deja el resultado en Evidence.gemini_analysis (el gate lo consulta).
+    Si frena el límite propio de Gemini (no la cuota del proveedor) se reencola
+    con demora; el alumno sigue viendo 'procesando'.
+    """
+    evidence = Evidence.objects.select_related('attempt__exam').filter(id=evidence_id).first()
+    if not evidence:
+        return None
+    intento = (evidence.gemini_analysis or {}).get('intento', 1)
+    try:
+        result = _verify_dni(evidence, base64_clean, intento)
+    except gemini.GeminiRateLimited as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=DNI_RATE_LIMIT_COUNTDOWN)
+        result = _dni_error_result(str(e), intento)
+    except Exception as e:
+        # Nunca queda en 'procesando': el gate esperaría para siempre
+        logger.exception("Falló la verificación del DNI (evidencia %s)", evidence_id)
+        result = _dni_error_result(f"Error interno: {str(e)}", intento)
+
+    Evidence.objects.filter(id=evidence_id).update(gemini_analysis=result)
+    return result['status']
+
+
+def _verify_dni(evidence, base64_clean, intento):
+    """Resultado para Evidence.gemini_analysis; si falla deja el evento IDENTITY_MISMATCH."""
+    attempt = evidence.attempt
+
+    # 1) OCR local (sin red ni cuotas); 2) Gemini solo como respaldo
+    numbers = extract_document_numbers(base64.b64decode(base64_clean))
+    force_manual = False
+    if numbers and legajo_matches(numbers, attempt.student_legajo):
+        ok, error, modelo = True, '', f"ocr:{settings.DNI_OCR_BACKEND}"
+    elif gemini.is_configured():
+        try:
+            ok, error, modelo, force_manual = check_dni(base64_clean, attempt.student_legajo, attempt.exam.tenant_id)
+        except gemini.GeminiRateLimited:
+            raise
+        except Exception as e:
+            ok, error, modelo = False, f"Error interno: {str(e)}", ''
+    elif numbers is None:
+        ok, error, modelo = True, '', 'simulacion'
+    else:
+        ok, error, modelo = False, f"Legajo no coincide ({', '.join(numbers) or 'sin números'})", f"ocr:{settings.DNI_OCR_BACKEND}"
+
+    if ok:
+        result = {'status': 'success', 'modelo': modelo, 'intento': intento}
+        if modelo == 'simulacion':
+            result['message'] = 'Simulación (Sin API Key).'
+    else:
+        AttemptEvent.objects.create(
+            attempt=attempt, event_type='IDENTITY_MISMATCH',
+            subtype=EVENT_SUBTYPE_DNI_VALIDATION, outcome=EVENT_OUTCOME_FAILED,
+            metadata={'reason': f'Fallo ({intento}): {error}'}
+        )
+        final = intento >= MAX_DNI_ATTEMPTS or force_manual
+        result = {'status': 'manual_review' if final else 'retry', 'error': error, 'intento': intento}
+    return result
+
+
+def _dni_error_result(error, intento):
+    """Sin veredicto: el alumno reintenta, o pasa a revisión manual si era el último intento."""
+    return {'status': 'manual_review' if intento >= MAX_DNI_ATTEMPTS else 'retry', 'error': error, 'intento': intento}
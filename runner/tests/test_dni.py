@@ -0,0 +1,116 @@
+"""
+Verificación del DNI con Gemini en modo stub: el límite propio reencola la
+tarea y solo la cuota agotada del proveedor manda a revisión manual.
+"""
+import base64
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from exams.models import Exam
+from plataforma import gemini
+from runner.dni import check_dni
+from runner.models import Attempt, Evidence
+from runner.tasks import verify_dni
+from tenancy.models import Tenant
+
+STUB = dict(GEMINI_BACKEND='stub', GEMINI_STUB_REPLIES={}, DNI_OCR_BACKEND='',
+            GEMINI_GLOBAL_BURST=100, GEMINI_TENANT_BURST=100)
+LEGAJO = '30123456'
+MATCHING_DNI = {'dni': '{"es_documento": true, "numeros": "30123456"}'}
+
+
+def image_b64():
+    """Imagen distinta en cada test: el veredicto se cachea por contenido."""
+    return base64.b64encode(uuid.uuid4().bytes).decode()
+
+
+@override_settings(**STUB)
+class CheckDniTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('plataforma.gemini.get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('runner.verdicts.get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def test_default_stub_does_not_match(self):
+        ok, error, _, force_manual = check_dni(image_b64(), LEGAJO)
+        self.assertFalse(ok)
+        self.assertIn('00000000', error)
+        self.assertFalse(force_manual)
+
+    def test_configured_stub_matches(self):
+        with self.settings(GEMINI_STUB_REPLIES=MATCHING_DNI):
+            ok, _, _, _ = check_dni(image_b64(), LEGAJO)
+        self.assertTrue(ok)
+
+    def test_upstream_quota_forces_manual_review(self):
+        with self.settings(GEMINI_STUB_REPLIES={'dni': 429}):
+            ok, _, _, force_manual = check_dni(image_b64(), LEGAJO)
+        self.assertFalse(ok)
+        self.assertTrue(force_manual)
+
+    def test_local_rate_limit_propagates(self):
+        with mock.patch.object(gemini, 'generate_json', side_effect=gemini.GeminiRateLimited("Límite")):
+            with self.assertRaises(gemini.GeminiRateLimited):
+                check_dni(image_b64(), LEGAJO)
+
+    def test_bad_base64(self):
+        self.assertEqual(check_dni('a', LEGAJO), (False, "Imagen ilegible", '', False))
+
+
+@override_settings(**STUB)
+class VerifyDniTaskTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('plataforma.gemini.get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('runner.verdicts.get_redis', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        tenant = Tenant.objects.create(name='Universidad de Prueba')
+        author = User.objects.create(username='docente')
+        exam = Exam.objects.create(tenant=tenant, author=author, title='Parcial')
+        attempt = Attempt.objects.create(exam=exam, student_name='Alumno', student_legajo=LEGAJO)
+        self.evidence = Evidence.objects.create(attempt=attempt, kind=Evidence.KIND_DNI, file_url='dni.jpg',
+                                                gemini_analysis={'status': 'procesando', 'intento': 1})
+
+    def analysis(self):
+        self.evidence.refresh_from_db()
+        return self.evidence.gemini_analysis
+
+    def test_success_with_configured_stub(self):
+        with self.settings(GEMINI_STUB_REPLIES=MATCHING_DNI):
+            verify_dni.apply(args=(self.evidence.id, image_b64()))
+        self.assertEqual(self.analysis()['status'], 'success')
+
+    def test_local_rate_limit_requeues(self):
+        with mock.patch('runner.tasks.check_dni', side_effect=gemini.GeminiRateLimited("Límite")), \
+                mock.patch.object(verify_dni, 'retry', side_effect=RuntimeError('reencolada')) as retry:
+            with self.assertRaisesMessage(RuntimeError, 'reencolada'):
+                verify_dni.apply(args=(self.evidence.id, image_b64()), throw=True)
+        self.assertEqual(retry.call_args.kwargs['countdown'], 15)
+        self.assertEqual(self.analysis()['status'], 'procesando')
+
+    def test_local_rate_limit_exhausted_lets_student_retry(self):
+        with mock.patch('runner.tasks.check_dni', side_effect=gemini.GeminiRateLimited("Límite")):
+            verify_dni.apply(args=(self.evidence.id, image_b64()), retries=verify_dni.max_retries)
+        self.assertEqual(self.analysis()['status'], 'retry')
+
+    def test_upstream_quota_goes_to_manual_review(self):
+        with self.settings(GEMINI_STUB_REPLIES={'dni': 429}):
+            verify_dni.apply(args=(self.evidence.id, image_b64()))
+        self.assertEqual(self.analysis()['status'], 'manual_review')
+
+    def test_unexpected_error_never_stays_processing(self):
+        with mock.patch('runner.tasks.extract_document_numbers', side_effect=RuntimeError('boom')), \
+                self.assertLogs('runner.tasks', 'ERROR'):
+            verify_dni.apply(args=(self.evidence.id, image_b64()))
+        self.assertEqual(self.analysis()['status'], 'retry')
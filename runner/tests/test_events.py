@@ -0,0 +1,72 @@
+"""
+Timestamps de los eventos del runner: el client_ts (acotado a la ventana de
+envío) ordena la línea de tiempo, no el momento en que llegó el lote.
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from exams.models import Exam
+from runner.events import EVENT_FLUSH_SECONDS, CLIENT_TS_TOLERANCE_SECONDS, build_event, event_timestamp, ingest_events
+from runner.models import Attempt, AttemptEvent
+from runner.timeline import TimelineAnalyzer, refresh_timeline
+from tenancy.models import Tenant
+
+ATTEMPT_ID = '2f1e0c7a-5a41-4a55-9a3b-7d1a2c3e4f50'
+
+
+class EventTimestampTests(SimpleTestCase):
+    def test_client_ts_is_used(self):
+        sent = timezone.now() - timedelta(seconds=3)
+        event = build_event(ATTEMPT_ID, {'event_type': 'FOCUS_GAINED', 'client_ts': sent.isoformat()})
+        self.assertEqual(event.timestamp, sent)
+        self.assertEqual(event.metadata['client_ts'], sent.isoformat())
+
+    def test_epoch_millis(self):
+        sent = timezone.now().replace(microsecond=0) - timedelta(seconds=2)
+        event = build_event(ATTEMPT_ID, {'event_type': 'FOCUS_GAINED', 'client_ts': int(sent.timestamp() * 1000)})
+        self.assertEqual(event.timestamp, sent)
+
+    def test_clamped_to_send_window(self):
+        now = timezone.now()
+        window = timedelta(seconds=EVENT_FLUSH_SECONDS + CLIENT_TS_TOLERANCE_SECONDS)
+        self.assertEqual(event_timestamp(now + timedelta(hours=1), now), now)
+        self.assertEqual(event_timestamp(now - timedelta(hours=1), now), now - window)
+        self.assertEqual(event_timestamp(None, now), now)
+
+    def test_invalid_client_ts_falls_back_to_now(self):
+        before = timezone.now()
+        event = build_event(ATTEMPT_ID, {'event_type': 'FOCUS_GAINED', 'client_ts': 'ayer'})
+        self.assertGreaterEqual(event.timestamp, before)
+        self.assertNotIn('client_ts', event.metadata)
+
+
+class BatchedReturnTimelineTests(TestCase):
+    def setUp(self):
+        tenant = Tenant.objects.create(name='Universidad de Prueba')
+        author = User.objects.create(username='docente')
+        exam = Exam.objects.create(tenant=tenant, author=author, title='Parcial')
+        self.now = timezone.now()
+        self.attempt = Attempt.objects.create(exam=exam, student_name='Alumno', student_legajo='123')
+        # start_time es auto_now_add
+        Attempt.objects.filter(id=self.attempt.id).update(start_time=self.now - timedelta(minutes=5))
+        self.attempt.refresh_from_db()
+
+    def test_answer_after_batched_focus_gained_is_suspicious(self):
+        # FOCUS_LOST y ANSWER_SAVED se escriben al instante; FOCUS_GAINED llega después en el lote
+        lost = AttemptEvent.objects.create(attempt=self.attempt, event_type='FOCUS_LOST',
+                                           timestamp=self.now - timedelta(seconds=20))
+        AttemptEvent.objects.create(attempt=self.attempt, event_type='ANSWER_SAVED', metadata={'qid': 7},
+                                    timestamp=self.now - timedelta(seconds=2))
+        gained = build_event(self.attempt.id, {
+            'event_type': 'FOCUS_GAINED', 'client_ts': (self.now - timedelta(seconds=4)).isoformat(),
+        })
+        ingest_events(self.attempt.id, [gained])
+
+        analyzer = TimelineAnalyzer(refresh_timeline(self.attempt).state)
+        annotation = analyzer.annotation(lost.id)
+        self.assertEqual(annotation['duration_away'], 16)
+        self.assertTrue(annotation['suspicious_answer'])
+        self.assertIn('7', analyzer.question_alerts)
@@ -0,0 +1,103 @@
+"""
+Subida directa al bucket contra un S3 simulado (moto), sin credenciales reales.
+El mismo flujo corre contra MinIO local configurando S3_ENDPOINT_URL.
+"""
+import json
+import unittest
+from unittest import mock
+
+import requests
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase
+
+from exams.models import Exam
+from runner.models import Attempt, Evidence
+from runner.storage import is_uploaded_evidence, new_evidence_path, presigned_upload
+from tenancy.models import Tenant
+
+try:
+    import boto3
+    from moto import mock_aws
+    from storages.backends.s3 import S3Storage
+except ImportError:  # moto es solo de desarrollo (requirements-dev.txt)
+    mock_aws = None
+
+BUCKET = 'plataforma-test'
+ATTEMPT_ID = '2f1e0c7a-5a41-4a55-9a3b-7d1a2c3e4f50'
+
+
+def fake_s3(testcase):
+    """Bucket vacío en moto y default_storage apuntando a él durante el test."""
+    aws = mock_aws()
+    aws.start()
+    testcase.addCleanup(aws.stop)
+    boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+    storage = S3Storage(bucket_name=BUCKET, access_key='test', secret_key='test', region_name='us-east-1',
+                        signature_version='s3v4', file_overwrite=False)
+    patcher = mock.patch('runner.storage.default_storage', storage)
+    patcher.start()
+    testcase.addCleanup(patcher.stop)
+    return storage
+
+
+@unittest.skipUnless(mock_aws, "requiere moto")
+class PresignedUploadTests(SimpleTestCase):
+    def setUp(self):
+        self.storage = fake_s3(self)
+
+    def test_put_to_presigned_url_stores_object(self):
+        path = new_evidence_path(ATTEMPT_ID, 'INCIDENTE')
+        upload = presigned_upload(path)
+
+        self.assertEqual(upload['method'], 'PUT')
+        r = requests.put(upload['url'], data=b'jpeg-bytes', headers=upload['headers'])
+        self.assertEqual(r.status_code, 200)
+        with self.storage.open(path) as f:
+            self.assertEqual(f.read(), b'jpeg-bytes')
+
+    def test_confirm_requires_existing_object(self):
+        path = new_evidence_path(ATTEMPT_ID, 'INCIDENTE')
+        self.assertFalse(is_uploaded_evidence(ATTEMPT_ID, path))
+
+        requests.put(presigned_upload(path)['url'], data=b'x', headers={'Content-Type': 'image/jpeg'})
+        self.assertTrue(is_uploaded_evidence(ATTEMPT_ID, path))
+
+    def test_confirm_rejects_other_attempt_paths(self):
+        other = new_evidence_path('00000000-0000-0000-0000-000000000000', 'INCIDENTE')
+        self.storage.save(other, ContentFile(b'x'))
+        self.assertFalse(is_uploaded_evidence(ATTEMPT_ID, other))
+        self.assertFalse(is_uploaded_evidence(ATTEMPT_ID, f"evidence/{ATTEMPT_ID}/../x.jpg"))
+
+
+@unittest.skipUnless(mock_aws, "requiere moto")
+class DirectUploadViewTests(TestCase):
+    def setUp(self):
+        self.storage = fake_s3(self)
+        tenant = Tenant.objects.create(name='Universidad de Prueba')
+        author = User.objects.create(username='docente')
+        exam = Exam.objects.create(tenant=tenant, author=author, title='Parcial')
+        self.attempt = Attempt.objects.create(exam=exam, student_name='Alumno', student_legajo='123')
+
+    def post(self, name, data):
+        return self.client.post(f"/api/{name}/{self.attempt.id}/", json.dumps(data), content_type='application/json')
+
+    def test_upload_url_then_confirm(self):
+        upload = self.post('evidence-upload-url', {'kind': 'INCIDENTE'}).json()
+        self.assertEqual(upload['mode'], 'presigned')
+        requests.put(upload['url'], data=b'jpeg', headers=upload['headers'])
+
+        with mock.patch('runner.views.process_uploaded_evidence.delay') as process:
+            r = self.post('log-event', {'event_type': 'NO_FACE', 'evidence_path': upload['path']})
+        self.assertEqual(r.status_code, 200)
+        evidence = Evidence.objects.get(attempt=self.attempt)
+        self.assertEqual(evidence.file_url, upload['path'])
+        process.assert_called_once_with(evidence.id)
+
+    def test_confirm_without_upload_is_ignored(self):
+        upload = self.post('evidence-upload-url', {'kind': 'FACE_REF'}).json()
+
+        r = self.post('register-biometrics', {'reference_face_path': upload['path']})
+        self.assertEqual(r.status_code, 200)
+        self.attempt.refresh_from_db()
+        self.assertIsNone(self.attempt.reference_face_url)
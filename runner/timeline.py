@@ -0,0 +1,144 @@
+"""
+Análisis de la línea de tiempo de incidentes de un intento, en una sola pasada.
+
+Correlaciona cada FOCUS_LOST/FULLSCREEN_EXIT con el siguiente FOCUS_GAINED
+(tiempo fuera) y con el primer ANSWER_SAVED dentro de los 30 s posteriores al
+retorno (respuesta sospechosa). Es incremental: el estado queda guardado en
+AttemptTimeline y cada corrida solo procesa los eventos nuevos.
+"""
+from datetime import datetime
+
+from django.db import transaction
+
+from .archive import attempt_events
+from .models import AttemptEvent, AttemptTimeline
+
+AWAY_EVENTS = ('FOCUS_LOST', 'FULLSCREEN_EXIT')
+SUSPICIOUS_WINDOW_SECONDS = 30
+
+
+def _ts(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class TimelineAnalyzer:
+    """
+    Estado (serializable a JSON):
+    - away: {event_id: {ts, return_ts, next_ts, reaction_time}} por cada salida
+    - pending: salidas que todavía esperan su FOCUS_GAINED
+    - window: retorno cuyo ANSWER_SAVED sospechoso seguimos esperando
+    - prev_away: salida que espera el timestamp del evento siguiente
+    """
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.away = state.get('away', {})
+        self.pending = state.get('pending', [])
+        self.window = state.get('window')
+        self.prev_away = state.get('prev_away')
+        self.hidden = state.get('hidden', [])
+        self.question_alerts = state.get('question_alerts', {})
+
+    def to_state(self):
+        return {
+            'away': self.away, 'pending': self.pending, 'window': self.window,
+            'prev_away': self.prev_away, 'hidden': self.hidden,
+            'question_alerts': self.question_alerts,
+        }
+
+    def feed(self, event_id, event_type, timestamp, metadata):
+        key = str(event_id)
+        ts = timestamp.isoformat()
+
+        # Fallback de duración: el evento inmediatamente posterior a una salida
+        if self.prev_away:
+            self.away[self.prev_away]['next_ts'] = ts
+            self.prev_away = None
+
+        # Ventana de respuesta sospechosa tras un retorno
+        if self.window:
+            gained_ts = _ts(self.window['gained_ts'])
+            elapsed = (timestamp - gained_ts).total_seconds()
+            if elapsed > SUSPICIOUS_WINDOW_SECONDS:
+                self.window = None
+            elif event_type == 'ANSWER_SAVED':
+                reaction = int(elapsed)
+                for away_id in self.window['aways']:
+                    self.away[away_id]['reaction_time'] = reaction
+                qid = (metadata or {}).get('qid')
+                if qid: self.question_alerts[str(qid)] = f"Respondió {reaction}s después de incidente"
+                self.hidden.append(event_id)
+                self.window = None
+            elif event_type in AWAY_EVENTS:
+                self.window = None
+
+        if event_type in AWAY_EVENTS:
+            self.away[key] = {'ts': ts, 'return_ts': None, 'next_ts': None, 'reaction_time': None}
+            self.pending.append(key)
+            self.prev_away = key
+        elif event_type == 'FOCUS_GAINED' and self.pending:
+            # Todas las salidas pendientes vuelven con este retorno
+            for away_id in self.pending:
+                self.away[away_id]['return_ts'] = ts
+            self.window = {'gained_ts': ts, 'aways': self.pending}
+            self.pending = []
+
+    def annotation(self, event_id):
+        """Atributos para el template: duration_away, return_timestamp, suspicious_answer, reaction_time."""
+        record = self.away.get(str(event_id))
+        if not record:
+            return {}
+        ts, return_ts, next_ts = _ts(record['ts']), _ts(record['return_ts']), _ts(record['next_ts'])
+        duration = int((return_ts - ts).total_seconds()) if return_ts else None
+        if not duration and next_ts:
+            duration = int((next_ts - ts).total_seconds())
+        result = {'duration_away': duration, 'return_timestamp': return_ts}
+        if record['reaction_time'] is not None:
+            result.update(suspicious_answer=True, reaction_time=record['reaction_time'])
+        return result
+
+
+def _event_rows(attempt, after_id=0):
+    """(id, event_type, timestamp, metadata) desde el inicio del intento, en orden (timestamp, id)."""
+    if attempt.events_archive_path:
+        # Intento archivado: su partición puede ya no existir
+        return [
+            (e.id, e.event_type, e.timestamp, e.metadata) for e in attempt_events(attempt)
+            if e.id > after_id and (not attempt.start_time or e.timestamp >= attempt.start_time)
+        ]
+    events = AttemptEvent.objects.filter(attempt=attempt, id__gt=after_id)
+    if attempt.start_time:
+        events = events.filter(timestamp__gte=attempt.start_time)
+    return list(events.order_by('timestamp', 'id').values_list('id', 'event_type', 'timestamp', 'metadata'))
+
+
+def refresh_timeline(attempt):
+    """
+    Actualiza el análisis guardado del intento procesando solo los eventos nuevos.
+    Si llega un evento con timestamp anterior al último procesado (commit tardío)
+    o cambió el inicio del intento, se recalcula desde cero.
+    """
+    with transaction.atomic():
+        timeline, _ = AttemptTimeline.objects.select_for_update().get_or_create(attempt=attempt)
+
+        new_events = _event_rows(attempt, after_id=timeline.last_event_id)
+        rebuild = timeline.start_time != attempt.start_time or (
+            new_events and timeline.last_timestamp and new_events[0][2] < timeline.last_timestamp
+        )
+        if rebuild:
+            new_events = _event_rows(attempt)
+            analyzer = TimelineAnalyzer()
+        elif not new_events:
+            return timeline
+        else:
+            analyzer = TimelineAnalyzer(timeline.state)
+
+        for event in new_events:
+            analyzer.feed(*event)
+
+        timeline.state = analyzer.to_state()
+        timeline.start_time = attempt.start_time
+        timeline.last_event_id = max((e[0] for e in new_events), default=0)
+        timeline.last_timestamp = new_events[-1][2] if new_events else None
+        timeline.save()
+    return timeline
@@ -6,6 +6,7 @@ app_name = 'runner'
 urlpatterns = [
     # 1. RUTAS FIJAS
     path('api/validate-dni/<uuid:attempt_id>/', views.validate_dni_ocr, name='validate_dni'),
+    path('api/validate-dni/<uuid:attempt_id>/status/<int:evidence_id>/', views.validate_dni_status, name='validate_dni_status'),
     path('portal/', views.portal_docente_view, name='portal_docente'),
     path('teacher/', views.teacher_home_view, name='teacher_home'),
 
@@ -21,6 +22,9 @@ urlpatterns = [
     # APIs del Examen
     path('api/save-answer/<uuid:attempt_id>/', views.save_answer, name='save_answer'),
     path('api/log-event/<uuid:attempt_id>/', views.log_event, name='log_event'),
+    path('api/log-events/<uuid:attempt_id>/', views.log_events_batch, name='log_events_batch'),
+    path('api/evidence-upload-url/<uuid:attempt_id>/', views.evidence_upload_url, name='evidence_upload_url'),
+    path('api/heartbeat/<uuid:attempt_id>/', views.heartbeat, name='heartbeat'),
     
     # Timer
     path('api/start-timer/<uuid:attempt_id>/', views.start_exam_timer, name='start_timer'),
@@ -0,0 +1,58 @@
+"""
+Cache direccionado por contenido de los veredictos de OCR/IA sobre imágenes.
+
+La clave es sha256(bytes decodificados) + backend/versión: la misma foto
+reenviada (reintentos del gate) no vuelve a gastar cuota de Gemini ni CPU de
+OCR. Se guarda lo que el backend leyó (no la decisión final), así el cruce
+con el legajo se sigue haciendo en cada intento. Cada entrada vence a las
+VERDICT_TTL y, con Redis, un índice ordenado por antigüedad limita el total a
+VERDICT_MAX_ENTRIES (sin Redis, el LocMemCache ya tiene su propio tope).
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from plataforma.redis_client import get_redis
+
+VERDICT_TTL = 60 * 60 * 12
+VERDICT_MAX_ENTRIES = 20000
+INDEX_KEY = 'verdicts:index'
+
+
+def image_digest(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _key(backend, digest):
+    return f"verdict:{backend}:{digest}"
+
+
+def get_verdicts(backends, digest):
+    """{backend: veredicto} de los backends que ya analizaron esta imagen."""
+    keys = {_key(backend, digest): backend for backend in backends}
+    found = cache.get_many(keys.keys())
+    return {keys[key]: value for key, value in found.items()}
+
+
+def get_verdict(backend, digest):
+    return cache.get(_key(backend, digest))
+
+
+def store_verdict(backend, digest, verdict):
+    key = _key(backend, digest)
+    cache.set(key, verdict, VERDICT_TTL)
+
+    client = get_redis()
+    if client is None:
+        return
+    now = time.time()
+    pipe = client.pipeline(transaction=False)
+    pipe.zadd(INDEX_KEY, {key: now})
+    pipe.zremrangebyscore(INDEX_KEY, 0, now - VERDICT_TTL)
+    pipe.zcard(INDEX_KEY)
+    size = pipe.execute()[-1]
+    if size > VERDICT_MAX_ENTRIES:
+        # Desalojamos las más viejas
+        evicted = client.zpopmin(INDEX_KEY, size - VERDICT_MAX_ENTRIES)
+        cache.delete_many([name.decode() for name, _ in evicted])
@@ -1,10 +1,7 @@
 import random
 import json
 import base64
-import re
-import os
 import traceback
-import requests
 import time
 import uuid
 from io import BytesIO
@@ -12,31 +9,31 @@ from PIL import Image
 
 # Django Imports
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.template.loader import render_to_string
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-from django.db.models import Q 
+from django.db.models import Q, Case, When, Value, CharField, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
 
 # Librerías Externas
 from weasyprint import HTML
-import google.generativeai as genai 
 
 # Modelos
 from exams.models import Exam
-from .models import Attempt, AttemptEvent, Evidence
-
-# --- CONFIGURACIÓN GEMINI ---
-GOOGLE_API_KEY = os.environ.get("GEMINI_API_KEY", "").strip()
-
-if GOOGLE_API_KEY:
-    try:
-        genai.configure(api_key=GOOGLE_API_KEY)
-    except:
-        pass
+from exams.answer_key import get_answer_key, grade, answer_hash
+from .models import Attempt, Evidence, EVENT_SUBTYPE_DNI_VALIDATION
+from .events import build_event, record_events, MAX_BATCH_EVENTS
+from .tasks import store_evidence_image, process_uploaded_evidence, analyze_attempt_timeline, verify_dni
+from .timeline import TimelineAnalyzer, refresh_timeline
+from .archive import attempt_events
+from .idempotency import idempotent
+from .heartbeat import record_heartbeat, online_attempt_ids
+from .dni import dni_status_response
+from .storage import EVIDENCE_UPLOAD_KINDS, new_evidence_path, is_uploaded_evidence, presigned_upload, signed_urls
 
 # --- FUNCIONES AUXILIARES ---
 def is_staff(user):
@@ -45,54 +42,21 @@ def is_staff(user):
 def es_docente_o_admin(user):
     return user.is_staff or user.groups.filter(name='Docente').exists()
 
-def get_secure_url(path_reference):
-    """
-    Genera una URL firmada fresca si es un path relativo.
-    Si ya es una URL completa (legacy/error), la devuelve tal cual.
-    """
-    if not path_reference:
-        return None
-    
-    # Si empieza con http, asumimos que es un link viejo o externo
-    if str(path_reference).startswith('http'):
-        return path_reference
-        
-    try:
-        # Genera link válido por el tiempo default del storage (ej. 1 hora)
-        return default_storage.url(path_reference)
-    except Exception as e:
-        print(f"Error generando URL firmada: {e}")
-        return None
+def extract_base64(image_data):
+    """Quita el prefijo 'data:image/...;base64,' de un data-URL (si lo tiene)."""
+    if not image_data:
+        return ''
+    if ';base64,' in image_data:
+        return image_data.split(';base64,')[1]
+    return image_data
 
 # --- CÁLCULO DE NOTA CENTRALIZADO ---
 def calculate_final_score(attempt):
-    exam = attempt.exam
-    score_obtained = 0
-    total_possible_points = 0
-    questions = exam.items.all()
-    answers = attempt.answers or {}
-    penalized = [str(x) for x in (attempt.penalized_items or [])]
-
-    for q in questions:
-        link = exam.examitemlink_set.filter(item=q).first()
-        points_for_question = link.points if link else 1.0
-        total_possible_points += points_for_question
-        
-        if str(q.id) in penalized:
-            continue 
-
-        selected = answers.get(str(q.id))
-        if selected:
-            correct = next((o for o in (q.options or []) if o.get('correct')), None)
-            if correct and correct.get('text') == selected:
-                score_obtained += points_for_question
-
-    final_score = 0.0
-    if total_possible_points > 0: 
-        final_score = (score_obtained / total_possible_points) * 10
-    
-    final_score -= (attempt.penalty_points or 0.0)
-    return max(0.0, final_score)
+    # Clave compilada y cacheada: corregir no consulta la base
+    return grade(
+        get_answer_key(attempt.exam_id), attempt.answers,
+        attempt.penalized_items, attempt.penalty_points
+    )
 
 # ==========================================
 # SECCIÓN ALUMNO
@@ -126,10 +90,13 @@ def lobby_view(request, access_code):
             active_attempt.save()
             return redirect('runner:tech_check', access_code=exam.access_code, attempt_id=active_attempt.id)
 
-        attempt = Attempt.objects.create(
+        attempt = Attempt(
             exam=exam, student_name=nombre, student_legajo=legajo,
             ip_address=request.META.get('REMOTE_ADDR')
         )
+        # Versión y orden de preguntas/opciones se fijan una sola vez, acá
+        attempt.pin_exam_version(exam)
+        attempt.save()
         return redirect('runner:tech_check', access_code=exam.access_code, attempt_id=attempt.id)
         
     return render(request, 'runner/lobby.html', {'exam': exam})
@@ -147,151 +114,84 @@ def biometric_gate_view(request, access_code, attempt_id):
     return redirect('runner:exam_runner', access_code=access_code, attempt_id=attempt.id)
 
 # 4. REGISTRO BIOMÉTRICO (Guarda PATH)
+# La subida a R2 se hace en Celery: acá solo fijamos el path provisorio y encolamos.
 @require_POST
+@idempotent
 def register_biometrics(request, attempt_id):
     try:
-        attempt = get_object_or_404(Attempt, id=attempt_id)
+        if not Attempt.objects.filter(id=attempt_id).exists():
+            return JsonResponse({'status': 'error', 'message': 'Intento inexistente.'}, status=404)
         data = json.loads(request.body)
-        
-        if 'reference_face' in data:
-            image_data = data['reference_face']
-            if image_data:
-                if ';base64,' in image_data: base64_clean = image_data.split(';base64,')[1]
-                else: base64_clean = image_data
-                try:
-                    image_content = base64.b64decode(base64_clean)
-                    filename = f"evidence/FACE_REF_{attempt.id}_{uuid.uuid4().hex[:6]}.jpg"
-                    # Guardamos PATH relativo
-                    saved_path = default_storage.save(filename, ContentFile(image_content))
-                    attempt.reference_face_url = saved_path 
-                except Exception as e:
-                    print(f"Error subiendo referencia facial: {e}")
-
-        if 'dni_image' in data:
-             image_data = data['dni_image']
-             if image_data:
-                if ';base64,' in image_data: base64_clean = image_data.split(';base64,')[1]
-                else: base64_clean = image_data
-                try:
-                    image_content = base64.b64decode(base64_clean)
-                    filename = f"evidence/DNI_REF_{attempt.id}_{uuid.uuid4().hex[:6]}.jpg"
-                    # Guardamos PATH relativo
-                    saved_path = default_storage.save(filename, ContentFile(image_content))
-                    attempt.photo_id_url = saved_path 
-                except Exception as e:
-                    print(f"Error subiendo referencia DNI: {e}")
-            
-        attempt.save()
+
+        pending_paths = {}
+        for key, prefix, field in (('reference_face', 'FACE_REF', 'reference_face_url'),
+                                   ('dni_image', 'DNI_REF', 'photo_id_url')):
+            # Subida directa al bucket: el navegador solo nos manda el path
+            uploaded_path = data.get(f'{key}_path')
+            if is_uploaded_evidence(attempt_id, uploaded_path):
+                pending_paths[field] = uploaded_path
+                continue
+
+            base64_clean = extract_base64(data.get(key))
+            if not base64_clean:
+                continue
+            filename = f"evidence/{prefix}_{attempt_id}_{uuid.uuid4().hex[:6]}.jpg"
+            pending_paths[field] = filename
+            store_evidence_image.delay(base64_clean, filename, attempt_id=str(attempt_id), attempt_field=field)
+
+        if pending_paths:
+            Attempt.objects.filter(id=attempt_id).update(**pending_paths)
         return JsonResponse({'status': 'ok'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
 # 5. VALIDACIÓN DNI (Guarda PATH)
+# La verificación con Gemini corre en Celery (runner.tasks.verify_dni): el gate
+# solo encola y después consulta validate_dni_status, que es una lectura por PK.
 @require_POST
+@idempotent
 def validate_dni_ocr(request, attempt_id):
     try:
         attempt = get_object_or_404(Attempt, id=attempt_id)
-        intentos_previos = Evidence.objects.filter(attempt=attempt).exclude(file_url__contains='INCIDENTE').count()
+        intentos_previos = Evidence.objects.filter(attempt=attempt, kind=Evidence.KIND_DNI).count()
         intento_actual = intentos_previos + 1
         
         data = json.loads(request.body)
-        image_data = data.get('image', '')
-        if ';base64,' in image_data: base64_clean = image_data.split(';base64,')[1]
-        else: base64_clean = image_data
+        base64_clean = extract_base64(data.get('image', ''))
             
         if not base64_clean: return JsonResponse({'success': False, 'message': 'Imagen vacía.'})
         
-        image_content = base64.b64decode(base64_clean)
         file_name = f"evidence/dni_{attempt.id}_intento_{intento_actual}_{uuid.uuid4().hex[:8]}.jpg"
         
-        # Guardamos PATH
-        saved_path = default_storage.save(file_name, ContentFile(image_content))
-        attempt.photo_id_url = saved_path
-        attempt.save()
+        # Guardamos PATH provisorio; la subida real la hace Celery
+        attempt.photo_id_url = file_name
+        attempt.save(update_fields=['photo_id_url'])
 
         # En evidencia también guardamos PATH
-        Evidence.objects.create(
-            attempt=attempt, file_url=saved_path, timestamp=timezone.now(),
+        evidence = Evidence.objects.create(
+            attempt=attempt, file_url=file_name, kind=Evidence.KIND_DNI, timestamp=timezone.now(),
             gemini_analysis={'intento': intento_actual, 'status': 'procesando'}
         )
+        store_evidence_image.delay(
+            base64_clean, file_name, attempt_id=str(attempt.id),
+            attempt_field='photo_id_url', evidence_id=evidence.id
+        )
+        verify_dni.delay(evidence.id, base64_clean)
     except Exception as e:
         return JsonResponse({'success': False, 'message': f'Error interno: {str(e)}'})
 
-    if not GOOGLE_API_KEY:
-        return JsonResponse({'success': True, 'message': 'Simulación (Sin API Key).'})
-
-    modelos = ["gemini-flash-lite-latest", "gemini-2.0-flash-lite", "gemini-2.0-flash"]
-    ia_success = False
-    error_actual = ""
-    modelo_usado = ""
-    force_manual = False 
-    MAX_INTENTOS = 3
-
-    payload = {
-        "contents": [{
-            "parts": [
-                { "text": "Analiza esta imagen. Responde SOLO JSON: {\"es_documento\": true, \"numeros\": \"123456\"}. Si no es DNI, false." },
-                { "inline_data": { "mime_type": "image/jpeg", "data": base64_clean } }
-            ]
-        }]
-    }
-    headers = {'Content-Type': 'application/json'}
-
-    for m in modelos:
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{m}:generateContent?key={GOOGLE_API_KEY}"
-        try:
-            r = requests.post(api_url, headers=headers, json=payload, timeout=10)
-            if r.status_code == 200:
-                modelo_usado = m
-                res = r.json()
-                cands = res.get('candidates', [])
-                if not cands:
-                    error_actual = "IA bloqueó la imagen"
-                    break 
-                raw = cands[0].get('content', {}).get('parts', [])[0].get('text', '')
-                ai_data = json.loads(raw.replace('```json', '').replace('```', '').strip())
-                
-                if ai_data.get('es_documento'):
-                    nums = str(ai_data.get('numeros', ''))
-                    legajo = re.sub(r'[^0-9]', '', str(attempt.student_legajo))
-                    if legajo and (legajo in nums or nums in legajo):
-                        ia_success = True
-                        break 
-                    else:
-                        error_actual = f"Legajo no coincide ({nums})"
-                        break 
-                else:
-                    error_actual = "No es DNI válido"
-                    break 
-            elif r.status_code == 429:
-                if m == modelos[-1]: force_manual = True
-                continue
-            else:
-                error_actual = f"Error API ({r.status_code})"
-                break 
-        except Exception as e:
-            error_actual = f"Red: {str(e)}"
-            break
-
-    if ia_success:
-        last = Evidence.objects.filter(attempt=attempt).last()
-        if last:
-            last.gemini_analysis = {'status': 'success', 'modelo': modelo_usado, 'intento': intento_actual}
-            last.save()
-        return JsonResponse({'success': True, 'message': 'Identidad verificada.'})
-    else:
-        try:
-            AttemptEvent.objects.create(attempt=attempt, event_type='IDENTITY_MISMATCH', metadata={'reason': f'Fallo ({intento_actual}): {error_actual}'})
-        except: pass
+    return JsonResponse({
+        'success': None, 'pending': True, 'evidence_id': evidence.id,
+        'status_url': reverse('runner:validate_dni_status', args=[attempt.id, evidence.id]),
+    })
 
-        if intento_actual >= MAX_INTENTOS or force_manual:
-            last = Evidence.objects.filter(attempt=attempt).last()
-            if last:
-                last.gemini_analysis = {'status': 'manual_review', 'error': error_actual, 'intento': intento_actual}
-                last.save()
-            return JsonResponse({'success': True, 'warning': True, 'message': 'Pase a revisión manual.', 'retry': False})
-        else:
-            return JsonResponse({'success': False, 'message': f'Fallo: {error_actual}. Reintentando...', 'retry': True})
+def validate_dni_status(request, attempt_id, evidence_id):
+    analysis = Evidence.objects.filter(
+        id=evidence_id, attempt_id=attempt_id
+    ).values_list('gemini_analysis', flat=True).first()
+    if analysis is None:
+        return JsonResponse({'done': True, 'success': False, 'message': 'Validación inexistente.'}, status=404)
+    return JsonResponse(dni_status_response(analysis))
 
 # 6. RUNNER
 def exam_runner_view(request, access_code, attempt_id):
@@ -300,7 +200,10 @@ def exam_runner_view(request, access_code, attempt_id):
     if attempt.completed_at or attempt.review_status in ['rejected', 'approved']: 
         return redirect('runner:exam_finished', attempt_id=attempt.id)
 
-    total_duration = exam.get_total_duration_seconds()
+    # Payload de la versión fijada al crear el intento (cacheado): sin consultar ítems
+    # ni re-mezclar en cada carga/reconexión
+    compiled = attempt.get_exam_payload()
+    total_duration = compiled['total_duration']
     if attempt.start_time:
         elapsed = (timezone.now() - attempt.start_time).total_seconds()
         remaining = max(0, total_duration - elapsed)
@@ -314,8 +217,7 @@ def exam_runner_view(request, access_code, attempt_id):
 
     if remaining <= 0 and attempt.start_time: return redirect('runner:submit_exam', attempt_id=attempt.id)
 
-    items = list(exam.items.all())
-    if exam.shuffle_items: random.Random(str(attempt.id)).shuffle(items)
+    items = attempt.get_ordered_items()
     
     saved_answers = attempt.answers or {}
     initial_step = len(saved_answers)
@@ -327,7 +229,7 @@ def exam_runner_view(request, access_code, attempt_id):
         'items': items,
         'total_questions': len(items),
         'remaining_seconds': int(remaining),
-        'time_per_item': exam.time_per_item,
+        'time_per_item': compiled['time_per_item'],
         'initial_step': initial_step,
         'has_started': attempt.start_time is not None
     })
@@ -336,29 +238,40 @@ def exam_runner_view(request, access_code, attempt_id):
 @require_POST
 def start_exam_timer(request, attempt_id):
     try:
-        attempt = get_object_or_404(Attempt, id=attempt_id)
-        if not attempt.start_time:
-            attempt.start_time = timezone.now()
-            attempt.save(update_fields=['start_time'])
+        # UPDATE condicional: si el timer ya estaba iniciado no se escribe nada
+        Attempt.objects.filter(id=attempt_id, start_time__isnull=True).update(start_time=timezone.now())
         return JsonResponse({'status': 'ok'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
 # 7. GUARDAR RESPUESTA
+# Escritura atómica: un solo UPDATE que mergea SOLO la clave respondida en el JSONB
+# (sin leer el intento antes). Dos guardados superpuestos ya no se pisan entre sí.
 @require_POST
+@idempotent
 def save_answer(request, attempt_id):
     try:
-        attempt = get_object_or_404(Attempt, id=attempt_id)
-        if not attempt.start_time:
-            attempt.start_time = timezone.now()
-            attempt.save(update_fields=['start_time'])
-
         data = json.loads(request.body)
-        current_answers = attempt.answers or {}
-        current_answers[str(data.get('question_id'))] = data.get('answer')
-        attempt.answers = current_answers
-        attempt.save(update_fields=['answers', 'last_heartbeat']) 
-        AttemptEvent.objects.create(attempt=attempt, event_type='ANSWER_SAVED', metadata={'qid': data.get('question_id')})
+        qid = str(data.get('question_id'))
+        answer = data.get('answer')
+
+        updated = Attempt.objects.filter(id=attempt_id).exclude(
+            # Si la respuesta ya está guardada (doble clic / reintento), no escribimos nada
+            answers__contains={qid: answer}
+        ).update(
+            answers=RawSQL(
+                "COALESCE(answers, '{}'::jsonb) || jsonb_build_object(%s::text, %s::jsonb)",
+                (qid, json.dumps(answer))
+            ),
+            last_heartbeat=timezone.now()
+        )
+
+        if not updated:
+            if not Attempt.objects.filter(id=attempt_id).exists():
+                return JsonResponse({'status': 'error'}, status=404)
+            return JsonResponse({'status': 'ok', 'unchanged': True})
+
+        record_events(attempt_id, [build_event(attempt_id, {'event_type': 'ANSWER_SAVED', 'metadata': {'qid': data.get('question_id')}})])
         return JsonResponse({'status': 'ok'})
     except Exception as e:
         return JsonResponse({'status': 'error'}, status=400)
@@ -371,23 +284,19 @@ def submit_exam_view(request, attempt_id):
     attempt.completed_at = timezone.now()
     attempt.score = calculate_final_score(attempt)
     attempt.save()
+    # El análisis de incidentes queda listo para el docente
+    analyze_attempt_timeline.delay(str(attempt.id))
     return redirect('runner:exam_finished', attempt_id=attempt.id)
 
 # 9. PANTALLA FINAL
 def exam_finished_view(request, attempt_id):
-    attempt = get_object_or_404(Attempt, id=attempt_id)
-    events = attempt.events.all()
-    
-    risk_score = 0
-    risk_score += events.filter(event_type='FOCUS_LOST').count() * 1
-    risk_score += events.filter(event_type='FULLSCREEN_EXIT').count() * 2
-    risk_score += events.filter(event_type='NO_FACE').count() * 3
-    risk_score += events.filter(event_type='MULTI_FACE').count() * 5
-    risk_score += events.filter(event_type='IDENTITY_MISMATCH').exclude(metadata__reason__startswith='Fallo').count() * 10
+    attempt = get_object_or_404(Attempt.objects.select_related('exam__tenant'), id=attempt_id)
+    # Puntaje precalculado al insertar cada evento (ver runner.models.apply_risk_counters)
+    risk_score = attempt.risk_score
     
     limit_high = attempt.exam.tenant.risk_threshold_high
     
-    last_dni = Evidence.objects.filter(attempt=attempt).exclude(file_url__contains='INCIDENTE').last()
+    last_dni = Evidence.objects.filter(attempt=attempt, kind=Evidence.KIND_DNI).last()
     dni_manual = False
     if last_dni and last_dni.gemini_analysis.get('status') in ['manual_review', 'failed', 'error']:
         dni_manual = True
@@ -402,22 +311,22 @@ def exam_finished_view(request, attempt_id):
     if en_revision:
         return render(request, 'runner/finished.html', {'attempt': attempt, 'en_revision': True, 'risk_score': risk_score})
 
-    items = attempt.exam.items.all()
+    # Mismo orden que vio el alumno; la corrección sale de la clave vigente (cacheada)
+    items = attempt.get_ordered_items()
+    answer_key = get_answer_key(attempt.exam_id)['items']
     student_answers = attempt.answers or {}
     penalized_set = set(str(x) for x in (attempt.penalized_items or []))
     detalles = []
     
     for item in items:
-        sid = str(item.id)
+        sid = str(item['id'])
         user_response = student_answers.get(sid)
-        correct_option = next((o for o in (item.options or []) if o.get('correct')), None)
-        correct_text = correct_option.get('text') if correct_option else None
-        es_correcta = False
-        if user_response and correct_text and user_response == correct_text: es_correcta = True
+        correct_hash = answer_key.get(sid, (0, None))[1]
+        es_correcta = bool(user_response and correct_hash and answer_hash(user_response) == correct_hash)
         
         detalles.append({
             'es_correcta': es_correcta, 
-            'pregunta_id': item.id,
+            'pregunta_id': item['id'],
             'is_penalized': sid in penalized_set
         })
 
@@ -430,86 +339,212 @@ def exam_finished_view(request, attempt_id):
 
 # 10. LOGS (Guarda PATH)
 @require_POST
+@idempotent
 def log_event(request, attempt_id):
     try:
-        attempt = get_object_or_404(Attempt, id=attempt_id)
+        if not Attempt.objects.filter(id=attempt_id).exists():
+            return JsonResponse({'status': 'error', 'message': 'Intento inexistente.'}, status=404)
         data = json.loads(request.body)
-        event_type = data.get('event_type')
-        metadata = data.get('metadata', {})
-        image_data = data.get('image', None) 
-        evidence_url = None
-
-        if image_data:
-            if ';base64,' in image_data: base64_clean = image_data.split(';base64,')[1]
-            else: base64_clean = image_data
-            
-            image_content = base64.b64decode(base64_clean)
-            filename = f"evidence/INCIDENTE_{attempt.id}_{uuid.uuid4().hex[:6]}.jpg"
-            # Guardamos PATH
-            saved_path = default_storage.save(filename, ContentFile(image_content))
-            
-            Evidence.objects.create(
-                attempt=attempt, file_url=saved_path, timestamp=timezone.now(),
+        # Validamos antes de tocar la evidencia
+        event = build_event(attempt_id, {'event_type': data.get('event_type'), 'metadata': data.get('metadata')})
+        event_type, metadata = event.event_type, event.metadata
+        base64_clean = extract_base64(data.get('image', None))
+        uploaded_path = data.get('evidence_path')
+        evidence = uploaded_evidence = None
+
+        if is_uploaded_evidence(attempt_id, uploaded_path):
+            # La imagen ya está en el bucket (URL pre-firmada): solo registramos el path
+            uploaded_evidence = Evidence.objects.create(
+                attempt_id=attempt_id, file_url=uploaded_path, kind=Evidence.KIND_INCIDENT, timestamp=timezone.now(),
+                gemini_analysis={'tipo': 'INCIDENTE', 'motivo': event_type, 'alerta': 'ALTA'}
+            )
+            metadata['evidence_path'] = uploaded_path
+        elif base64_clean:
+            filename = f"evidence/INCIDENTE_{attempt_id}_{uuid.uuid4().hex[:6]}.jpg"
+            # Path provisorio: el worker sube la imagen y lo corrige si hiciera falta
+            evidence = Evidence.objects.create(
+                attempt_id=attempt_id, file_url=filename, kind=Evidence.KIND_INCIDENT, timestamp=timezone.now(),
                 gemini_analysis={'tipo': 'INCIDENTE', 'motivo': event_type, 'alerta': 'ALTA'}
             )
             # En metadata guardamos el path
-            metadata['evidence_path'] = saved_path
+            metadata['evidence_path'] = filename
+
+        # Repeticiones consecutivas (NO_FACE cada 1 s, etc.) se fusionan en un intervalo.
+        # En modo stream se encola y no hay fila todavía (created vacío)
+        created = record_events(attempt_id, [event])
 
-        AttemptEvent.objects.create(attempt=attempt, event_type=event_type, metadata=metadata)
+        if evidence:
+            event_id = created[0].id if created else None
+            store_evidence_image.delay(base64_clean, evidence.file_url, evidence_id=evidence.id, event_id=event_id, dedupe=True)
+        elif uploaded_evidence:
+            process_uploaded_evidence.delay(uploaded_evidence.id)
         return JsonResponse({'status': 'ok'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
+# 10b. LOGS EN LOTE (Cola del runner, sin imágenes)
+@require_POST
+@idempotent
+def log_events_batch(request, attempt_id):
+    try:
+        data = json.loads(request.body)
+        raw_events = data.get('events')
+        if not isinstance(raw_events, list) or not raw_events:
+            return JsonResponse({'status': 'error', 'message': 'Lote vacío.'}, status=400)
+        if len(raw_events) > MAX_BATCH_EVENTS:
+            return JsonResponse({'status': 'error', 'message': f'Máximo {MAX_BATCH_EVENTS} eventos por lote.'}, status=400)
+
+        if not Attempt.objects.filter(id=attempt_id).exists():
+            return JsonResponse({'status': 'error', 'message': 'Intento inexistente.'}, status=404)
+
+        events = []
+        rejected = 0
+        for raw in raw_events:
+            try:
+                events.append(build_event(attempt_id, raw))
+            except ValueError:
+                rejected += 1
+
+        # Un solo INSERT para todo el lote (repeticiones consecutivas fusionadas en intervalos),
+        # o un XADD por evento si la ingesta va por el stream
+        created = record_events(attempt_id, events)
+        return JsonResponse({'status': 'ok', 'saved': len(events), 'rows': len(created), 'rejected': rejected})
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+# 10c. URL PRE-FIRMADA (Subida directa navegador -> bucket)
+@require_POST
+@idempotent
+def evidence_upload_url(request, attempt_id):
+    try:
+        data = json.loads(request.body or '{}')
+        kind = data.get('kind', 'INCIDENTE')
+        if kind not in EVIDENCE_UPLOAD_KINDS:
+            return JsonResponse({'status': 'error', 'message': 'Tipo de evidencia inválido.'}, status=400)
+        if not Attempt.objects.filter(id=attempt_id).exists():
+            return JsonResponse({'status': 'error', 'message': 'Intento inexistente.'}, status=404)
+
+        path = new_evidence_path(attempt_id, kind)
+        upload = presigned_upload(path)
+        if not upload:
+            # Storage sin soporte de pre-firmado: el cliente manda la imagen inline
+            return JsonResponse({'status': 'ok', 'mode': 'inline'})
+        return JsonResponse({'status': 'ok', 'mode': 'presigned', 'path': path, **upload})
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+# 10d. HEARTBEAT (Solo Redis: nunca un UPDATE por latido, ver runner.heartbeat)
+@require_POST
+def heartbeat(request, attempt_id):
+    record_heartbeat(attempt_id)
+    return JsonResponse({'status': 'ok'})
+
 # 11. DASHBOARD DOCENTE
+DASHBOARD_PAGE_SIZE = 50
+DNI_FAILED_STATUSES = ['manual_review', 'failed', 'error']
+STATUS_TEXTS = {
+    'green': "Confiable",
+    'yellow': "Riesgo Medio",
+    'red': "Alto Riesgo / Rev. Manual",
+    'blue': "Validado",
+    'gray': "Anulado",
+    'indigo': "En Revisión (Guardado)",
+}
+# sort -> campo de orden (siempre descendente, desempate por id)
+DASHBOARD_SORTS = {
+    'recent': 'start_time',
+    'risk': 'risk_score',
+}
+
+def _encode_cursor(value, attempt_id):
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, str(attempt_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor, sort):
+    try:
+        value, attempt_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if sort == 'recent':
+            value = parse_datetime(value)
+        else:
+            value = int(value)
+        return value, uuid.UUID(attempt_id)
+    except Exception:
+        return None
+
+def dashboard_queryset(exam):
+    """
+    Un solo queryset anotado para el tablero: riesgo (contadores denormalizados),
+    estado de la última evidencia de DNI (Subquery) y color de estado (CASE en SQL),
+    para poder filtrar y ordenar en la base.
+    """
+    tenant = exam.tenant
+    last_dni_status = Evidence.objects.filter(
+        attempt=OuterRef('pk'), kind=Evidence.KIND_DNI
+    ).order_by('-timestamp', '-id').values('gemini_analysis__status')[:1]
+
+    return Attempt.objects.filter(exam=exam).annotate(
+        dni_status=Subquery(last_dni_status),
+    ).annotate(
+        status_color=Case(
+            When(review_status='approved', then=Value('blue')),
+            When(review_status='rejected', then=Value('gray')),
+            When(review_status='revision', then=Value('indigo')),
+            When(Q(risk_score__gt=tenant.risk_threshold_high) | Q(dni_status__in=DNI_FAILED_STATUSES), then=Value('red')),
+            When(risk_score__gt=tenant.risk_threshold_medium, then=Value('yellow')),
+            default=Value('green'),
+            output_field=CharField(),
+        )
+    )
+
 @login_required
 @user_passes_test(is_staff)
 def teacher_dashboard_view(request, exam_id):
-    exam = get_object_or_404(Exam, id=exam_id)
-    attempts = Attempt.objects.filter(exam=exam).order_by('-start_time').prefetch_related('events')
-    limit_medium = exam.tenant.risk_threshold_medium
-    limit_high = exam.tenant.risk_threshold_high
+    exam = get_object_or_404(Exam.objects.select_related('tenant'), id=exam_id)
+
+    status_filter = request.GET.get('status', '')
+    sort = request.GET.get('sort', 'recent')
+    if sort not in DASHBOARD_SORTS: sort = 'recent'
+    sort_field = DASHBOARD_SORTS[sort]
+
+    attempts = dashboard_queryset(exam)
+    # "En línea ahora": intentos sin terminar con un latido vigente en el cache
+    open_ids = Attempt.objects.filter(exam=exam, completed_at__isnull=True).values_list('id', flat=True)
+    online_ids = online_attempt_ids(open_ids)
+    if status_filter in STATUS_TEXTS:
+        attempts = attempts.filter(status_color=status_filter)
+    elif status_filter == 'online':
+        attempts = attempts.filter(id__in=online_ids)
+
+    # Paginación keyset (sin OFFSET): seguimos desde (valor de orden, id) del último de la página
+    cursor = _decode_cursor(request.GET['after'], sort) if request.GET.get('after') else None
+    if cursor:
+        value, last_id = cursor
+        attempts = attempts.filter(
+            Q(**{f'{sort_field}__lt': value}) | Q(**{sort_field: value, 'id__lt': last_id})
+        )
+    page = list(attempts.order_by(f'-{sort_field}', '-id')[:DASHBOARD_PAGE_SIZE + 1])
+    has_next = len(page) > DASHBOARD_PAGE_SIZE
+    page = page[:DASHBOARD_PAGE_SIZE]
 
     results = []
-    for attempt in attempts:
-        events = attempt.events.all()
-        risk_score = 0
-        risk_score += events.filter(event_type='FOCUS_LOST').count() * 1
-        risk_score += events.filter(event_type='FULLSCREEN_EXIT').count() * 2
-        risk_score += events.filter(event_type='NO_FACE').count() * 3
-        risk_score += events.filter(event_type='MULTI_FACE').count() * 5
-        risk_score += events.filter(event_type='IDENTITY_MISMATCH').exclude(metadata__reason__startswith='Fallo').count() * 10
-        
-        dni_failed = False
-        last_dni = Evidence.objects.filter(attempt=attempt).exclude(file_url__contains='INCIDENTE').last()
-        if last_dni and last_dni.gemini_analysis.get('status') in ['manual_review', 'failed', 'error']:
-            dni_failed = True
-
-        status_color = 'green'
-        status_text = "Confiable"
-        
-        if risk_score > limit_high or dni_failed: 
-            status_color = 'red'
-            status_text = "Alto Riesgo / Rev. Manual"
-        elif risk_score > limit_medium: 
-            status_color = 'yellow'
-            status_text = "Riesgo Medio"
-        
-        if attempt.review_status == 'approved':
-            status_color = 'blue'
-            status_text = "Validado"
-        elif attempt.review_status == 'rejected':
-            status_color = 'gray'
-            status_text = "Anulado"
-        elif attempt.review_status == 'revision':
-            status_color = 'indigo'
-            status_text = "En Revisión (Guardado)"
-        
+    for attempt in page:
         results.append({
-            'attempt': attempt, 'risk_score': risk_score, 'status_color': status_color, 
-            'status_text': status_text, 'event_count': events.count(), 
-            'show_grade': (status_color in ['green', 'blue', 'indigo'])
+            'attempt': attempt, 'risk_score': attempt.risk_score, 'status_color': attempt.status_color,
+            'status_text': STATUS_TEXTS[attempt.status_color], 'event_count': attempt.event_count,
+            'show_grade': (attempt.status_color in ['green', 'blue', 'indigo']),
+            'is_online': str(attempt.id) in online_ids,
         })
-    return render(request, 'runner/teacher_dashboard.html', {'exam': exam, 'results': results})
+
+    next_cursor = None
+    if has_next and page:
+        last = page[-1]
+        next_cursor = _encode_cursor(getattr(last, sort_field), last.id)
+
+    return render(request, 'runner/teacher_dashboard.html', {
+        'exam': exam, 'results': results,
+        'status_filter': status_filter, 'sort': sort, 'next_cursor': next_cursor,
+        'status_choices': STATUS_TEXTS.items(), 'online_count': len(online_ids),
+    })
 
 # 12. DETALLE DEL INTENTO (Links frescos + Corrección temp_signed_url)
 @login_required
@@ -546,79 +581,80 @@ def attempt_detail_view(request, attempt_id):
         return redirect('runner:attempt_detail', attempt_id=attempt.id)
 
     # --- LECTURA ---
-    if attempt.start_time:
-        raw_events = list(attempt.events.filter(timestamp__gte=attempt.start_time).order_by('timestamp'))
+    # Análisis de incidentes guardado (runner.timeline): solo procesa eventos nuevos
+    timeline = refresh_timeline(attempt)
+    analyzer = TimelineAnalyzer(timeline.state)
+    question_alerts = analyzer.question_alerts
+
+    # Los reintentos de DNI se muestran en la sección de validación, no como incidentes
+    if attempt.events_archive_path:
+        # Intento archivado (runner.archive): mismos filtros, en memoria
+        hidden = set(analyzer.hidden)
+        events = [
+            e for e in attempt_events(attempt)
+            if e.event_type != 'FOCUS_GAINED' and e.subtype != EVENT_SUBTYPE_DNI_VALIDATION
+            and e.id not in hidden and (not attempt.start_time or e.timestamp >= attempt.start_time)
+        ]
     else:
-        raw_events = list(attempt.events.all().order_by('timestamp'))
+        events = attempt.events.exclude(event_type='FOCUS_GAINED').exclude(
+            subtype=EVENT_SUBTYPE_DNI_VALIDATION
+        ).exclude(id__in=analyzer.hidden)
+        if attempt.start_time:
+            events = events.filter(timestamp__gte=attempt.start_time)
+        events = events.order_by('timestamp', 'id')
 
-    final_events = []
-    skip_ids = set()
-    question_alerts = {} 
-
-    for i, event in enumerate(raw_events):
-        if event.id in skip_ids: continue
-        if event.event_type == 'FOCUS_GAINED': continue
-        if event.event_type == 'IDENTITY_MISMATCH':
-            reason = str(event.metadata.get('reason', ''))
-            if reason.startswith('Fallo'): continue
-
-        if event.event_type in ['FOCUS_LOST', 'FULLSCREEN_EXIT']:
-            for j in range(i + 1, len(raw_events)):
-                next_ev = raw_events[j]
-                if next_ev.event_type == 'FOCUS_GAINED':
-                    delta = (next_ev.timestamp - event.timestamp).total_seconds()
-                    event.duration_away = int(delta)
-                    event.return_timestamp = next_ev.timestamp
-                    skip_ids.add(next_ev.id)
-                    for k in range(j + 1, len(raw_events)):
-                        future_ev = raw_events[k]
-                        time_diff = (future_ev.timestamp - next_ev.timestamp).total_seconds()
-                        if time_diff > 30: break 
-                        if future_ev.event_type == 'ANSWER_SAVED':
-                            reaction = (future_ev.timestamp - next_ev.timestamp).total_seconds()
-                            event.suspicious_answer = True
-                            event.reaction_time = int(reaction)
-                            qid = future_ev.metadata.get('qid')
-                            if qid: question_alerts[str(qid)] = f"Respondió {int(reaction)}s después de incidente"
-                            skip_ids.add(future_ev.id)
-                            break
-                        if future_ev.event_type in ['FOCUS_LOST', 'FULLSCREEN_EXIT']: break
-                    break 
-            if not getattr(event, 'duration_away', None) and i + 1 < len(raw_events):
-                 delta = (raw_events[i+1].timestamp - event.timestamp).total_seconds()
-                 event.duration_away = int(delta)
-        
-        # --- Generar URL firmada en variable TEMPORAL (Evita el Error 500) ---
-        if event.metadata.get('evidence_path'):
-             event.temp_signed_url = get_secure_url(event.metadata.get('evidence_path'))
-        elif event.metadata.get('evidence_url'):
-             event.temp_signed_url = get_secure_url(event.metadata.get('evidence_url'))
+    evidence_all = Evidence.objects.filter(attempt=attempt).order_by('timestamp')
+    evidence_validation = [ev for ev in evidence_all if ev.kind != Evidence.KIND_INCIDENT]
+    # Miniaturas por path: la revisión carga primero la miniatura y el original a demanda
+    thumbnails = {ev.file_url: ev.thumbnail_url for ev in evidence_all if ev.thumbnail_url}
 
+    final_events = []
+    for event in events:
+        for attr, value in analyzer.annotation(event.id).items():
+            setattr(event, attr, value)
+        event.evidence_ref = event.metadata.get('evidence_path') or event.metadata.get('evidence_url')
         final_events.append(event)
 
-    evidence_all = Evidence.objects.filter(attempt=attempt).order_by('timestamp')
-    evidence_validation = [ev for ev in evidence_all if "INCIDENTE" not in (ev.file_url or "")]
-    
+    # Todas las firmas de la página en un solo paso (cacheadas por path)
+    urls = signed_urls(
+        [attempt.photo_id_url, attempt.reference_face_url]
+        + [event.evidence_ref for event in final_events]
+        + list(thumbnails.values())
+        + [ev.file_url for ev in evidence_validation]
+    )
+
+    # --- URL firmada en variable TEMPORAL (Evita el Error 500) ---
+    for event in final_events:
+        if event.evidence_ref:
+            event.temp_signed_url = urls.get(event.evidence_ref)
+            thumb = thumbnails.get(event.evidence_ref)
+            if thumb: event.temp_thumb_url = urls.get(thumb)
+
     # Firmas principales
-    photo_id_signed = get_secure_url(attempt.photo_id_url)
-    face_ref_signed = get_secure_url(attempt.reference_face_url)
+    photo_id_signed = urls.get(attempt.photo_id_url)
+    face_ref_signed = urls.get(attempt.reference_face_url)
     
     # Firmas lista evidencias
     for ev in evidence_validation:
-        ev.signed_url = get_secure_url(ev.file_url)
+        ev.signed_url = urls.get(ev.file_url)
+        ev.thumb_url = urls.get(ev.thumbnail_url) or ev.signed_url
 
-    items = attempt.exam.items.all()
+    items = attempt.get_ordered_items()
+    answer_key = get_answer_key(attempt.exam_id)['items']
     student_answers = attempt.answers or {}
     penalized_set = set(str(x) for x in (attempt.penalized_items or []))
     qa_list = []
     for item in items:
-        sid = str(item.id)
+        sid = str(item['id'])
         user_response = student_answers.get(sid)
-        correct_option = next((o for o in (item.options or []) if o.get('correct')), None)
+        # Correcta según la clave vigente (puede haberse corregido después de rendir)
+        correct_hash = answer_key.get(sid, (0, None))[1]
+        correct_option = next((o for o in item['options'] if correct_hash and answer_hash(o.get('text')) == correct_hash), None) \
+            or next((o for o in item['options'] if o.get('correct')), None)
         correct_text = correct_option.get('text') if correct_option else "N/A"
-        is_correct = (user_response and user_response == correct_text)
+        is_correct = bool(user_response and correct_hash and answer_hash(user_response) == correct_hash)
         qa_list.append({
-            'id': item.id, 'question': item.stem, 'user_response': user_response,
+            'id': item['id'], 'question': item['stem'], 'user_response': user_response,
             'correct_response': correct_text, 'is_correct': is_correct,
             'is_penalized': sid in penalized_set, 'alert': question_alerts.get(sid)
         })
@@ -0,0 +1,61 @@
+# tenancy/migrations/0002_tenant_risk_weights.py
+from django.db import migrations, models
+
+# Los umbrales ya existen en las bases desplegadas (se agregaron fuera de migraciones):
+# solo los registramos en el estado, creando las columnas si faltan.
+THRESHOLDS_SQL = """
+ALTER TABLE tenancy_tenant ADD COLUMN IF NOT EXISTS risk_threshold_medium integer NOT NULL DEFAULT 4;
+ALTER TABLE tenancy_tenant ADD COLUMN IF NOT EXISTS risk_threshold_high integer NOT NULL DEFAULT 10;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenancy', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(THRESHOLDS_SQL, reverse_sql=migrations.RunSQL.noop),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='tenant',
+                    name='risk_threshold_medium',
+                    field=models.PositiveIntegerField(default=4, help_text='Si el puntaje supera este número, el estado pasa a Amarillo.', verbose_name='Umbral de Riesgo Medio (Amarillo)'),
+                ),
+                migrations.AddField(
+                    model_name='tenant',
+                    name='risk_threshold_high',
+                    field=models.PositiveIntegerField(default=10, help_text='Si el puntaje supera este número, el estado pasa a Rojo.', verbose_name='Umbral de Riesgo Alto (Rojo)'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='risk_weight_focus_lost',
+            field=models.PositiveIntegerField(default=1, verbose_name='Peso: Pérdida de Foco'),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='risk_weight_fullscreen_exit',
+            field=models.PositiveIntegerField(default=2, verbose_name='Peso: Salida de Pantalla Completa'),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='risk_weight_no_face',
+            field=models.PositiveIntegerField(default=3, verbose_name='Peso: Rostro no detectado'),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='risk_weight_multi_face',
+            field=models.PositiveIntegerField(default=5, verbose_name='Peso: Múltiples rostros'),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='risk_weight_identity_mismatch',
+            field=models.PositiveIntegerField(default=10, verbose_name='Peso: Suplantación de Identidad'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# tenancy/migrations/0003_tenant_risk_interval_seconds.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenancy', '0002_tenant_risk_weights'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='risk_interval_seconds',
+            field=models.PositiveIntegerField(default=0, help_text='Ponderación por duración de incidentes continuos. 0 = cada intervalo cuenta una vez.', verbose_name='Segundos por unidad extra de riesgo'),
+        ),
+    ]
@@ -24,6 +24,25 @@ class Tenant(models.Model):
         help_text="Si el puntaje supera este número, el estado pasa a Rojo."
     )
     # -------------------------------------------------
+
+    # --- PESOS DEL PUNTAJE DE RIESGO (por tipo de incidente) ---
+    risk_weight_focus_lost = models.PositiveIntegerField(default=1, verbose_name="Peso: Pérdida de Foco")
+    risk_weight_fullscreen_exit = models.PositiveIntegerField(default=2, verbose_name="Peso: Salida de Pantalla Completa")
+    risk_weight_no_face = models.PositiveIntegerField(default=3, verbose_name="Peso: Rostro no detectado")
+    risk_weight_multi_face = models.PositiveIntegerField(default=5, verbose_name="Peso: Múltiples rostros")
+    risk_weight_identity_mismatch = models.PositiveIntegerField(default=10, verbose_name="Peso: Suplantación de Identidad")
+
+    # Intervalos (NO_FACE, etc.): cada N segundos de duración suman una unidad más (0 = solo cuenta el intervalo)
+    risk_interval_seconds = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Segundos por unidad extra de riesgo",
+        help_text="Ponderación por duración de incidentes continuos. 0 = cada intervalo cuenta una vez."
+    )
+
+    RISK_WEIGHT_FIELDS = (
+        'risk_weight_focus_lost', 'risk_weight_fullscreen_exit', 'risk_weight_no_face',
+        'risk_weight_multi_face', 'risk_weight_identity_mismatch',
+    )
     
     class Meta:
         verbose_name = _("Institución (Tenant)")
@@ -32,6 +51,20 @@ class Tenant(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Si cambian los pesos, el risk_score guardado en cada intento queda viejo.
+        # (Los umbrales se aplican al leer, así que no requieren recálculo.)
+        weights_changed = False
+        if self.pk:
+            previous = Tenant.objects.filter(pk=self.pk).values(*self.RISK_WEIGHT_FIELDS).first()
+            weights_changed = bool(previous) and any(
+                previous[f] != getattr(self, f) for f in self.RISK_WEIGHT_FIELDS
+            )
+        super().save(*args, **kwargs)
+        if weights_changed:
+            from runner.models import Attempt, recompute_risk_scores
+            recompute_risk_scores(Attempt.objects.filter(exam__tenant=self))
+
 class TenantMembership(models.Model):
     """
     Define el ROL de un Usuario dentro de un Tenant.